@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+set -eou pipefail
+
+# Rewrites src/prototype_2/metadata/_domain_manifest.py, the config name -> domain
+# map ddl.py reads at startup instead of scanning the metadata modules.
+# Run after adding a parse config or changing an expected_domain_id, and commit the result;
+# test_ddl_domain_map fails while the manifest is out of date.
+
+cd "$(dirname "$0")/../src"
+python3 -c "from prototype_2 import ddl; ddl.write_domain_manifest()"
+echo "wrote src/prototype_2/metadata/_domain_manifest.py"
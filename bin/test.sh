@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -eou pipefail
 
+# keep typeguard's runtime checks on for tests, see typechecked_if_enabled in util.py
+export DDP_TYPECHECK=1
+
 echo test_value_transformations
  python3 -m unittest prototype_2.test.test_value_transformations
 echo "-----------------"
@@ -42,6 +45,22 @@ echo test_visit_FK_reconciliation
 python3 -m  unittest prototype_2.test.test_visit_FK_reconciliation
 echo "------------------"
 
+echo test_visit_FK_reconciliation_single_pass
+python3 -m  unittest prototype_2.test.test_visit_FK_reconciliation_single_pass
+echo "------------------"
+
+echo test_visit_hierarchy
+python3 -m  unittest prototype_2.test.test_visit_hierarchy
+echo "------------------"
+
+echo test_ddl_domain_map
+python3 -m  unittest prototype_2.test.test_ddl_domain_map
+echo "------------------"
+
+echo test_ddl_tables
+python3 -m  unittest prototype_2.test.test_ddl_tables
+echo "------------------"
+
 
 # load into DuckDB for constraint errors
 python3 -m omop.setup_omop
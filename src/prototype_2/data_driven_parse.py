@@ -75,9 +75,11 @@ import zlib
 from numpy import int32
 from numpy import int64
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from functools import partial
 from lxml import etree as ET
-from lxml.etree import XPathEvalError
-from typeguard import typechecked
+from lxml.etree import XPathError
 
 from prototype_2 import value_transformations as VT
 from prototype_2.metadata import get_meta_dict
@@ -85,6 +87,7 @@ from prototype_2 import ddl as DDL
 
 from prototype_2.util import cast_to_date
 from prototype_2.util import cast_to_datetime
+from prototype_2.util import typechecked_if_enabled as _typechecked
 
 from prototype_2 import visit_reconcilliation as VR
 import re
@@ -102,6 +105,20 @@ ns = {
    'sdtc': 'urn:hl7-org:sdtc'
 }
 
+# One lxml parser for every document. Comments and processing instructions are
+# not referenced by any metadata XPath, nor seen by itertext(), so drop them at
+# parse time and keep the trees the configs walk smaller.
+XML_PARSER = ET.XMLParser(remove_comments=True, remove_pis=True)
+
+
+@lru_cache(maxsize=4096)
+def _compile_xpath(path):
+    """ The metadata XPaths are the same for every document and every root element,
+        so compile each one once, against ns, and reuse it.
+        Raises lxml's XPathSyntaxError (an XPathError) for a malformed path.
+    """
+    return ET.XPath(path, namespaces=ns)
+
 
 #@typechecked
 def create_hash(input_string) -> int64 | None:
@@ -126,7 +143,7 @@ def create_hash_too_long(input_string):
     long_hash_value = int(hash_digest, 31)
     return long_hash_value
 
-@typechecked
+@_typechecked
 def parse_field_from_dict(field_details_dict :dict[str, str], root_element, 
         config_name, field_tag, root_path) ->  None | str | float | int | int32 | int64 | datetime.datetime | datetime.date | list:
     """ Retrieves a value for the field descrbied in field_details_dict that lies below
@@ -142,8 +159,8 @@ def parse_field_from_dict(field_details_dict :dict[str, str], root_element,
     logger.info(f"    FIELD {field_details_dict['element']} for {config_name}/{field_tag}")
     field_element = None
     try:
-        field_element = root_element.xpath(field_details_dict['element'], namespaces=ns)
-    except XPathEvalError as p:
+        field_element = _compile_xpath(field_details_dict['element'])(root_element)
+    except XPathError as p:
         pass
         logger.warning(f"ERROR (often inconsequential) {field_details_dict['element']} {p}")
     if field_element is None:
@@ -279,7 +296,7 @@ def parse_field_from_dict(field_details_dict :dict[str, str], root_element,
         return attribute_value
 
 
-@typechecked
+@_typechecked
 def do_none_fields(output_dict :dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date ],
                    root_element, root_path, config_name,  
                    config_dict :dict[str, dict[str, str | None]], 
@@ -292,7 +309,7 @@ def do_none_fields(output_dict :dict[str, None | str | float | int | int32 | int
             output_dict[field_tag] = None
 
             
-@typechecked
+@_typechecked
 def do_constant_fields(output_dict :dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date], 
                        root_element, root_path, config_name,  
                        config_dict :dict[str, dict[str, str | None]], 
@@ -311,7 +328,7 @@ def do_constant_fields(output_dict :dict[str, None | str | float | int | int32 |
                 output_dict[field_tag] = constant_value
 
             
-@typechecked
+@_typechecked
 def do_filename_fields(output_dict :dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date], 
                        root_element, root_path, config_name,  
                        config_dict :dict[str, dict[str, str | None]], 
@@ -325,7 +342,7 @@ def do_filename_fields(output_dict :dict[str, None | str | float | int | int32 |
             output_dict[field_tag] = filename
 
             
-@typechecked
+@_typechecked
 def do_basic_fields(output_dict :dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date], 
                     root_element, root_path, config_name,  
                     config_dict :dict[str, dict[str, str | None] ], 
@@ -367,7 +384,7 @@ def do_basic_fields(output_dict :dict[str, None | str | float | int | int32 | in
             logger.info("PK {config_name}/{field_tag} {type(attribute_value)} {attribute_value}")
             
 
-@typechecked 
+@_typechecked
 def do_foreign_key_fields(output_dict :dict[str, None | str | float | int | int32 | int64 |datetime.datetime | datetime.date], 
                     root_element, root_path, config_name,  
                     config_dict :dict[str, dict[str, str | None] ], 
@@ -433,7 +450,7 @@ def do_foreign_key_fields(output_dict :dict[str, None | str | float | int | int3
                 output_dict[field_tag] = None
                 error_fields_set.add(field_tag)
 
-@typechecked
+@_typechecked
 def do_derived_fields(output_dict: dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date],
                       root_element, root_path, config_name,
                       config_dict: dict[str, dict[str, str | None]],
@@ -513,7 +530,7 @@ def do_derived_fields(output_dict: dict[str, None | str | float | int | int32 |
                 output_dict[field_tag] = None
 
 
-@typechecked
+@_typechecked
 def do_derived2_fields(output_dict :dict[str, list | None | str | float | int | int32 | int64 | datetime.datetime | datetime.date], 
                       root_element, root_path, config_name,
                       config_dict :dict[str, dict[str, str | None | list]],
@@ -539,7 +556,7 @@ def do_derived2_fields(output_dict :dict[str, list | None | str | float | int |
 
 
                 
-@typechecked
+@_typechecked
 def do_hash_fields(output_dict: dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date],
                    root_element, root_path, config_name,
                    config_dict: dict[str, dict[str, str | None]],
@@ -572,7 +589,7 @@ def do_hash_fields(output_dict: dict[str, None | str | float | int | int32 | int
                          f"{field_tag}, {field_details_dict} {output_dict[field_tag]}"))
 
             
-@typechecked
+@_typechecked
 def do_priority_fields(output_dict: dict[str, None | str | float | int | int32 | int64 | datetime.datetime | datetime.date],
                        root_element, root_path, config_name,
                        config_dict: dict[str, dict[str, str | None]],
@@ -641,7 +658,7 @@ def do_priority_fields(output_dict: dict[str, None | str | float | int | int32 |
     return priority_fields
     
     
-@typechecked
+@_typechecked
 def get_extract_order_fn(dict):
     def get_order_from_dict(field_key):
         if 'order' in dict[field_key]:
@@ -654,41 +671,45 @@ def get_extract_order_fn(dict):
     return get_order_from_dict
 
 
-@typechecked
+@_typechecked
 def get_filter_fn(dict):
     def has_order_attribute(key):
         return 'order' in dict[key] and dict[key]['order'] is not None
     return has_order_attribute
 
 
-@typechecked
+@_typechecked
+def get_ordered_fields(config_dict :dict[str, dict[str, str | None]]) -> tuple[str, ...]:
+    """ Returns the names of the fields in config_dict that have an 'order',
+        sorted by it. Computed once per config so rows don't each re-sort.
+    """
+    filter_function = get_filter_fn(config_dict)
+    sort_function = get_extract_order_fn(config_dict) # curry in the config_dict arg.
+    return tuple(sorted(filter(filter_function, config_dict.keys()), key=sort_function))
+
+
+@_typechecked
 def sort_output_and_omit_dict(output_dict :dict[str, None | str | float | int | int64], 
-                     config_dict :dict[str, dict[str, str | None]], config_name):
+                     config_dict :dict[str, dict[str, str | None]], config_name,
+                     ordered_fields :tuple[str, ...] | None = None):
     """ Sorts the ouput_dict by the value of the 'order' fields in the associated
         config_dict. Fields without a value, or without an entry used to 
         come last, now are omitted.
+        Pass ordered_fields from get_ordered_fields() to skip sorting per row.
     """
-    ordered_output_dict = {}
-
-    sort_function = get_extract_order_fn(config_dict) # curry in the config_dict arg.
-    ordered_keys = sorted(config_dict.keys(), key=sort_function)
+    if ordered_fields is None:
+        ordered_fields = get_ordered_fields(config_dict)
 
-    filter_function = get_filter_fn(config_dict)
-    filtered_ordered_keys = filter(filter_function, ordered_keys)
+    return { key: output_dict[key] for key in ordered_fields if key in output_dict }
 
-    for key in filtered_ordered_keys:
-        if key in output_dict:
-            ordered_output_dict[key] = output_dict[key]
 
-    return ordered_output_dict
-
-
-@typechecked
+@_typechecked
 def parse_config_for_single_root(root_element, root_path, config_name, 
                                  config_dict :dict[str, dict[str, str | None]], 
                                  error_fields_set : set[str], 
                                  pk_dict :dict[str, list[any]],
-                                 filename :str) -> dict[str,  None | str | float | int | int64 |  datetime.datetime | datetime.date] | None:
+                                 filename :str,
+                                 ordered_fields :tuple[str, ...] | None = None) -> dict[str,  None | str | float | int | int64 |  datetime.datetime | datetime.date] | None:
 
     """  Parses for each field in the metadata for a config out of the root_element passed in.
          You may have more than one such root element, each making for a row in the output.
@@ -733,7 +754,7 @@ def parse_config_for_single_root(root_element, root_path, config_name,
             f"parse configuration \"{config_name}\" for a field called 'domain_id'. If you don't have one, add it."
             "If you do, check the spelling. Your row will be REJECTED or DENY/DENIED.")        
     domain_id = output_dict.get('domain_id', None) # fetch this before it gets omitted
-    output_dict = sort_output_and_omit_dict(output_dict, config_dict, config_name)
+    output_dict = sort_output_and_omit_dict(output_dict, config_dict, config_name, ordered_fields)
 
     # Strict: null domain_id is not good, but don't expect a domain id from non-domain tables
     if (expected_domain_id == domain_id
@@ -819,7 +840,7 @@ def make_distinct(rows):
 
 
 
-@typechecked
+@_typechecked
 def parse_config_from_xml_file(tree, config_name, 
                            config_dict :dict[str, dict[str, str | None]], filename, 
                            pk_dict :dict[str, list[any]]) -> list[ dict[str,  None | str | float | int | int64 | datetime.datetime | datetime.date] | None  ] | None:
@@ -839,7 +860,7 @@ def parse_config_from_xml_file(tree, config_name,
         It's a list of because you might have more than one instance of the root path, like when you
         get many observations.
         
-        arg: tree, this is the lxml.etree parse of the XML file
+        arg: tree, this is the lxml.etree parse of the XML file, see XML_PARSER
         arg: config_name, this is a key into the first level of the metadata, an often a OMOP domain name
         arg: config_dict, this is the value of that key in the dict
         arg: filename, the name of the XML file, for logging
@@ -864,7 +885,7 @@ def parse_config_from_xml_file(tree, config_name,
     #root_element_list = tree.findall(config_dict['root']['element'], ns)
     root_element_list = None
     try:
-        root_element_list = tree.xpath(config_dict['root']['element'], namespaces=ns)
+        root_element_list = _compile_xpath(config_dict['root']['element'])(tree)
     except Exception as e:
         logger.error(f" {config_dict['root']['element']} config:{config_name}   {e}")
         
@@ -876,9 +897,10 @@ def parse_config_from_xml_file(tree, config_name,
     output_list = []
     error_fields_set = set()
     logger.info(f"NUM ROOTS {config_name} {len(root_element_list)}")
+    ordered_fields = get_ordered_fields(config_dict)
     for root_element in root_element_list:
         output_dict = parse_config_for_single_root(root_element, root_path, 
-                config_name, config_dict, error_fields_set, pk_dict, filename)
+                config_name, config_dict, error_fields_set, pk_dict, filename, ordered_fields)
         if output_dict is not None:
             output_list.append(output_dict)
 
@@ -894,7 +916,7 @@ def parse_config_from_xml_file(tree, config_name,
 
 
 
-@typechecked
+@_typechecked
 def parse_string(ccda_string, file_path,
               metadata :dict[str, dict[str, dict[str, str]]]) -> dict[str, 
                       list[ dict[str,  None | str | float | int | int64 ] | None  ] | None]:
@@ -907,7 +929,7 @@ def parse_string(ccda_string, file_path,
     """
     omop_dict = {}
     pk_dict = defaultdict(list)
-    tree = ET.fromstring(ccda_string)
+    tree = ET.fromstring(ccda_string, XML_PARSER)
     base_name = os.path.basename(file_path)
     for config_name, config_dict in metadata.items():
         data_dict_list = parse_config_from_xml_file(tree, config_name, config_dict, base_name, pk_dict)
@@ -915,8 +937,9 @@ def parse_string(ccda_string, file_path,
             logger.info(f"DDP.py {config_name} {len(data_dict_list)}")
         else:
             logger.info(f"DDP.py {config_name} has None data_dict_list")
-        if config_name in omop_dict:
-            omop_dict[config_name] = omop_dict[config_name].extend(data_dict_list)
+        # list.extend() works in place and returns None, don't assign its result.
+        if omop_dict.get(config_name) is not None:
+            omop_dict[config_name].extend(data_dict_list or [])
         else:
             omop_dict[config_name] = data_dict_list
 
@@ -932,7 +955,7 @@ def parse_string(ccda_string, file_path,
     return omop_dict
 
 
-@typechecked
+@_typechecked
 def parse_doc(file_path, 
               metadata :dict[str, dict[str, dict[str, str]]],
               parse_config : str) -> dict[str, 
@@ -946,16 +969,17 @@ def parse_doc(file_path,
     """
     omop_dict = {}
     pk_dict = defaultdict(list) 
-    tree = ET.parse(file_path)
+    tree = ET.parse(file_path, XML_PARSER)
     base_name = os.path.basename(file_path)
     for config_name, config_dict in metadata.items():
         if parse_config is None or parse_config == '' or parse_config == config_name:
             data_dict_list = parse_config_from_xml_file(tree, config_name, config_dict, base_name, pk_dict)
-            if config_name in omop_dict: 
-                omop_dict[config_name] = omop_dict[config_name].extend(data_dict_list)
+            # list.extend() works in place and returns None, don't assign its result.
+            if omop_dict.get(config_name) is not None:
+                omop_dict[config_name].extend(data_dict_list or [])
             else:
                 omop_dict[config_name] = data_dict_list
-            logger.info(f"\nPROCESSED config \"{config_name}\" got:\"{omop_dict[config_name]}\" ")
+            logger.info("\nPROCESSED config \"%s\" got:\"%s\" ", config_name, omop_dict[config_name])
         #else:
         #    print(f"\nSKIPPING config \"{config_name}\" ")
 
@@ -977,7 +1001,7 @@ def parse_doc(file_path,
     return omop_dict
 
 
-@typechecked
+@_typechecked
 def print_omop_structure(omop :dict[str, list[ dict[str, None | str | float | int | int64 ] ] ], 
                          metadata :dict[str, dict[str, dict[str, str ] ] ] ):
     
@@ -1007,7 +1031,7 @@ def print_omop_structure(omop :dict[str, list[ dict[str, None | str | float | in
                     print(f"\n\nDOMAIN: {domain} {n}\n\n")
 
                     
-@typechecked
+@_typechecked
 def process_file(filepath :str, print_output: bool, parse_config :str):
     """ Process each configuration in the metadata for one file.
         - filepath
@@ -1025,8 +1049,7 @@ def process_file(filepath :str, print_output: bool, parse_config :str):
     print(f"    {filepath} parse_doc() ")
     omop_data = parse_doc(filepath, metadata, parse_config)
     print(f"    {filepath} reconcile_visit()() ")
-    VR.assign_visit_occurrence_ids_to_events(omop_data)
-    VR.assign_visit_detail_ids_to_events(omop_data)
+    VR.assign_visit_ids_to_events(omop_data)
     if print_output and (omop_data is not None or len(omop_data) < 1):
         print_omop_structure(omop_data, metadata)
     else:
@@ -1058,15 +1081,25 @@ def main() :
     parser.add_argument('-p', '--print_output', 
             type=str2bool, const=True, default=True,  nargs="?",
             help="print out the output values, -p False to have it not print")
+    parser.add_argument('-g', '--config', default='', help="parse configuration to use, all of them if not given")
+    parser.add_argument('-w', '--workers', type=int, default=None,
+            help="processes to spread a directory's files over, defaults to the number of CPUs. "
+                 "-w 1 runs serially, which keeps printed output in file order")
     args = parser.parse_args()
 
     if args.filename is not None:
-        process_file(args.filename, args.print_output)
+        process_file(args.filename, args.print_output, args.config)
     elif args.directory is not None:
-        only_files = [f for f in os.listdir(args.directory) if os.path.isfile(os.path.join(args.directory, f))]
-        for file in (only_files):
-            if file.endswith(".xml"):
-            	process_file(os.path.join(args.directory, file), args.print_output)
+        xml_paths = [os.path.join(args.directory, f) for f in os.listdir(args.directory)
+                     if f.endswith(".xml") and os.path.isfile(os.path.join(args.directory, f))]
+        # Files are independent: parse, reconcile and print each on its own.
+        process_one = partial(process_file, print_output=args.print_output, parse_config=args.config)
+        if args.workers == 1:
+            for xml_path in xml_paths:
+                process_one(xml_path)
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                list(executor.map(process_one, xml_paths))
     else:
         logger.error("Did args parse let us  down? Have neither a file, nor a directory.")
 
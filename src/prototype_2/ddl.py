@@ -17,25 +17,155 @@ OMOP_CSV_DATA_DIR = "output/"
 
 import io
 import os
+import sys
+import ast
 import re
 import logging
+import functools
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format='%(levelname)s: %(message)s',
-#    filename=f"logs/load_omop.log",
-#    force=True,
-    level=logging.INFO
-    # level=logging.WARNING level=logging.ERROR # level=logging.INFO # level=logging.DEBUG
-)
-
 
 
 METADATA_DIR = os.path.join(os.path.dirname(__file__), 'metadata')
 
 
+# The config name → domain map written ahead of time by bin/regen_manifest.sh, so
+# startup needn't scan the metadata
+DOMAIN_MANIFEST = os.path.join(METADATA_DIR, '_domain_manifest.py')
+
+
+def _dict_literal_entry(dict_node: ast.Dict, key: str):
+    """ The value node stored under the string constant key in a dict display, or None. """
+    value_node = None
+    for key_node, entry_node in zip(dict_node.keys, dict_node.values):
+        if isinstance(key_node, ast.Constant) and key_node.value == key:
+            value_node = entry_node
+    return value_node
+
+
+def domains_from_metadata_source(filename: str, source: bytes) -> Dict[str, str] | None:
+    """
+    Reads config names and their 'expected_domain_id' straight from the source of a
+    metadata module whose only mention of `metadata` is a top-level `metadata = {...}`
+    with literal config names, 'root' dicts and domain strings. Nothing is executed,
+    so the module's imports (numpy, value_transformations) aren't loaded.
+
+    Returns None when the file doesn't have that shape.
+    """
+    tree = ast.parse(source, filename)
+    if sum(1 for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id == 'metadata') != 1:
+        return None
+
+    metadata_node = None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id == 'metadata':
+            metadata_node = node.value
+    if not isinstance(metadata_node, ast.Dict):
+        return None
+
+    expected_domains = {}
+    for key_node, config_node in zip(metadata_node.keys, metadata_node.values):
+        if not (isinstance(key_node, ast.Constant) and isinstance(key_node.value, str)
+                and isinstance(config_node, ast.Dict)):
+            return None
+        expected_domain = None
+        root_node = _dict_literal_entry(config_node, 'root')
+        if root_node is not None:
+            if not isinstance(root_node, ast.Dict):
+                return None
+            domain_node = _dict_literal_entry(root_node, 'expected_domain_id')
+            if domain_node is not None:
+                if not isinstance(domain_node, ast.Constant):
+                    return None
+                expected_domain = domain_node.value
+        expected_domains[key_node.value] = expected_domain
+
+    domain_map = {}
+    for config_name, expected_domain in expected_domains.items():
+        if expected_domain:
+            domain_map[config_name] = expected_domain
+        else:
+            logger.warning("'%s' in '%s' is missing 'expected_domain_id'.", config_name, filename)
+    return domain_map
+
+
+# What loading a broken metadata module raises, as opposed to a bug here
+METADATA_MODULE_ERRORS = (SyntaxError, ImportError, AttributeError, KeyError, ValueError, OSError)
+
+
+def domains_from_metadata_module(filename: str, file_path: str) -> Dict[str, str]:
+    """
+    Executes one metadata module and returns its config names mapped to their
+    'expected_domain_id'.
+    """
+    domain_map = {}
+    module_name = filename[:-3]
+    try:
+        # Dynamically load the module from its file path
+        spec = importlib.util.spec_from_file_location(module_name, file_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        # Check if the module has the required 'metadata' dictionary
+        if hasattr(module, 'metadata'):
+            # --- CORE LOGIC: Extract the mapping ---
+            # Iterate through the top-level keys in the metadata dict
+            for config_name, domain_details in module.metadata.items():
+                # Safely get the nested 'expected_domain_id'
+                root_info = domain_details.get('root', {})
+                expected_domain = root_info.get('expected_domain_id')
+                if expected_domain:
+                    domain_map[config_name] = expected_domain
+                else:
+                    logger.warning("'%s' in '%s' is missing 'expected_domain_id'.", config_name, filename)
+        else:
+            logger.warning("Module '%s' does not contain a 'metadata' dictionary.", module_name)
+    except METADATA_MODULE_ERRORS as e:
+        # a malformed metadata file gets one log line; any other exception is a bug and propagates
+        logger.error("Failed to process metadata from '%s': %s: %s", filename, type(e).__name__, e)
+
+    return domain_map
+
+
+def read_metadata_source(entry: os.DirEntry) -> tuple[str, bytes | None]:
+    """ (filename, file contents), with None for contents that couldn't be read. """
+    try:
+        with open(entry.path, 'rb') as metadata_file:
+            return entry.name, metadata_file.read()
+    except OSError as e:
+        logger.warning("Couldn't read metadata file '%s': %s", entry.name, e)
+        return entry.name, None
+
+
+def domains_from_metadata_file(filename: str, file_path: str, source: bytes | None = None) -> Dict[str, str]:
+    """
+    One metadata file's config names mapped to their 'expected_domain_id', read
+    from its source when possible, otherwise by executing the module.
+    source is the file's contents, when the caller has already read them.
+    """
+    try:
+        if source is None:
+            with open(file_path, 'rb') as metadata_file:
+                source = metadata_file.read()
+        domain_map = domains_from_metadata_source(filename, source)
+        if domain_map is not None:
+            return domain_map
+    except (OSError, SyntaxError, ValueError) as e:
+        logger.warning("Couldn't read metadata from the source of '%s', importing it instead: %s", filename, e)
+    return domains_from_metadata_module(filename, file_path)
+
+
+def is_metadata_file(entry: os.DirEntry) -> bool:
+    """ A metadata module: a regular .py file, not __init__.py or an editor's hidden temp file. """
+    name = entry.name
+    return name.endswith('.py') and not name.startswith(('_', '.')) and entry.is_file(follow_symlinks=False)
+
+
 def generate_cfg_name_to_domain_map() -> Dict[str, str]:
     """
     Dict[table_name] --> domain name
@@ -45,42 +175,64 @@ def generate_cfg_name_to_domain_map() -> Dict[str, str]:
     to their 'expected_domain_id'.
     """
     domain_map = {}
-    if not os.path.isdir(METADATA_DIR):
-        logging.error(f"Metadata directory not found at: {METADATA_DIR}")
+    # Scan the directory for Python files in one pass
+    try:
+        with os.scandir(METADATA_DIR) as dir_entries:
+            entries = list(filter(is_metadata_file, dir_entries))
+    except OSError:
+        logger.error("Metadata directory not found at: %s", METADATA_DIR)
         return {}
 
-    # Scan the directory for Python files
-    for filename in os.listdir(METADATA_DIR):
-        if filename.endswith('.py') and filename != '__init__.py':
-            module_name = filename[:-3]
-            file_path = os.path.join(METADATA_DIR, filename)
-            try:
-                # Dynamically load the module from its file path
-                spec = importlib.util.spec_from_file_location(module_name, file_path)
-                module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(module)
-
-                # Check if the module has the required 'metadata' dictionary
-                if hasattr(module, 'metadata'):
-                    # --- CORE LOGIC: Extract the mapping ---
-                    # Iterate through the top-level keys in the metadata dict
-                    for config_name, domain_details in module.metadata.items():
-                        # Safely get the nested 'expected_domain_id'
-                        root_info = domain_details.get('root', {})
-                        expected_domain = root_info.get('expected_domain_id')
-                        if expected_domain:
-                            domain_map[config_name] = expected_domain
-                        else:
-                            logging.warning(f"'{config_name}' in '{filename}' is missing 'expected_domain_id'.")
-                else:
-                    logging.warning(f"Module '{module_name}' does not contain a 'metadata' dictionary.")
-            except Exception as e:
-                logging.error(f"Failed to process metadata from '{filename}': {e}")
+    # Read the files concurrently, so the wait on a cold filesystem is about
+    # the slowest file, not the sum of them; parse after.
+    sources = {}
+    if len(entries) > 1:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            sources = dict(executor.map(read_metadata_source, entries))
+
+    for e in entries:
+        domain_map.update(domains_from_metadata_file(e.name, e.path, sources.get(e.name)))
 
     return domain_map
 
 
-config_to_domain_name_dict = generate_cfg_name_to_domain_map()
+def write_domain_manifest(path: str = DOMAIN_MANIFEST) -> Dict[str, str]:
+    """ Scans the metadata and writes the config name → domain map out as a module. """
+    domain_map = generate_cfg_name_to_domain_map()
+    with open(path, 'w') as manifest_file:
+        manifest_file.write("# Generated by bin/regen_manifest.sh from the metadata modules, don't edit.\n"
+                            "# Regenerate it after adding a config or changing an expected_domain_id.\n\n"
+                            "MANIFEST = {\n")
+        for config_name in sorted(domain_map):
+            manifest_file.write(f"    {config_name!r}: {domain_map[config_name]!r},\n")
+        manifest_file.write("}\n")
+    return domain_map
+
+
+def load_domain_manifest() -> Dict[str, str] | None:
+    """ The map in DOMAIN_MANIFEST, or None when it hasn't been generated. """
+    try:
+        from prototype_2.metadata._domain_manifest import MANIFEST
+    except ImportError:
+        return None
+    return dict(MANIFEST)
+
+
+@functools.cache
+def get_config_to_domain_name_dict() -> Dict[str, str]:
+    """ The config name → domain map: from the manifest, else scanned, on first use instead of at import. """
+    domain_map = load_domain_manifest()
+    if domain_map is None:
+        logger.info("no metadata domain manifest at '%s', scanning the metadata", DOMAIN_MANIFEST)
+        domain_map = generate_cfg_name_to_domain_map()
+    return domain_map
+
+
+def __getattr__(name):
+    # config_to_domain_name_dict used to be built at import; keep that name working
+    if name == 'config_to_domain_name_dict':
+        return get_config_to_domain_name_dict()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 domain_name_to_table_name = {
@@ -118,13 +270,7 @@ sql_import_dict = {
             'device_source_concept_id'
         ],
         'sql': None,
-        'table_name': "device_exposure",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(device_exposure_id) as p_id, 
-                       count(distinct device_exposure_id) as d_p_id
-                FROM device_exposure
-                """
+        'table_name': "device_exposure"
     },
     'Procedure': {
         'column_list': [
@@ -144,13 +290,7 @@ sql_import_dict = {
             'modifier_source_value'
         ],
         'sql': None,
-        'table_name': "procedure_occurrence",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(procedure_occurrence_id) as p_id, 
-                       count(distinct procedure_occurrence_id) as d_p_id
-                FROM procedure_occurrence
-                """
+        'table_name': "procedure_occurrence"
     },
     'Drug': {
         'column_list': [
@@ -164,7 +304,7 @@ sql_import_dict = {
             'verbatim_end_date',
             'drug_type_concept_id',
             'stop_reason',
-            'refills integer',
+            'refills',
             'quantity',
             'days_supply',
             'sig',
@@ -179,13 +319,7 @@ sql_import_dict = {
             'dose_unit_source_value'
         ],
         'sql': None,
-        'table_name': "drug_exposure",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(drug_exposure_id) as p_id, 
-                       count(distinct drug_exposure_id) as d_p_id
-                FROM drug_exposure
-                """
+        'table_name': "drug_exposure"
     },
     'Observation': {
         'column_list': [
@@ -209,13 +343,7 @@ sql_import_dict = {
             'qualifier_source_value'
         ],
         'sql': None,
-        'table_name': "observation",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(observation_id) as p_id, 
-                       count(distinct observation_id) as d_p_id
-                FROM observation
-                """
+        'table_name': "observation"
     },
     'Location': {
         'column_list': [
@@ -223,13 +351,7 @@ sql_import_dict = {
             'county', 'location_source_value'
         ],
         'sql': None,
-        'table_name': "location",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(location_id) as p_id,
-                       count(distinct location_id) as d_p_id
-                FROM location
-                """
+        'table_name': "location"
     },
     'Provider': {
         'column_list': [
@@ -248,13 +370,7 @@ sql_import_dict = {
             'gender_source_concept_id'
         ],
         'sql': None,
-        'table_name': "provider",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                count(provider_id) as p_id, 
-                count(distinct provider_id) as d_p_id
-                FROM provider
-                """
+        'table_name': "provider"
     },
     'Care_Site': {
         'column_list': [
@@ -266,13 +382,7 @@ sql_import_dict = {
             'place_of_service_source_value'
         ],
         'sql': None,
-        'table_name': "care_site",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(care_site_id) as p_id, 
-                       count(distinct care_site_id) as d_p_id
-                FROM care_site
-                """
+        'table_name': "care_site"
     },
     'Person': {
         'column_list': [
@@ -283,13 +393,7 @@ sql_import_dict = {
             'race_source_concept_id', 'ethnicity_source_value', 'ethnicity_source_concept_id'
             ],
         'sql': None,
-        'table_name': "person",
-        'pk_query': """
-                SELECT count(*) as row_ct, 
-                       count(person_id) as p_id,
-                       count(distinct person_id) as d_p_id
-                FROM person
-                """
+        'table_name': "person"
     },
     'Visit': {
         'column_list': [
@@ -306,13 +410,7 @@ sql_import_dict = {
                     'preceding_visit_occurrence_id'
                     ],
         'sql': None,
-        'table_name': "visit_occurrence",
-        'pk_query': """
-                SELECT count(*) as row_ct,
-                       count(visit_occurrence_id) as p_id,
-                       count(distinct visit_occurrence_id) as d_p_id
-                FROM visit_occurrence
-                """
+        'table_name': "visit_occurrence"
     },
     'VisitDetail': {
         'column_list': [
@@ -330,17 +428,11 @@ sql_import_dict = {
                     'visit_occurrence_id'
                     ],
         'sql': None,
-        'table_name': "visit_detail",
-        'pk_query': """
-                SELECT count(*) as row_ct,
-                       count(visit_detail_id) as p_id,
-                       count(distinct visit_detail_id) as d_p_id
-                FROM visit_detail
-                """
+        'table_name': "visit_detail"
     },
     'Measurement': {
         'column_list': [
-                    'measurement_id', ' person_id', 'measurement_concept_id',
+                    'measurement_id', 'person_id', 'measurement_concept_id',
                     'measurement_date', 'measurement_datetime', 'measurement_time',
                     'measurement_type_concept_id', 'operator_concept_id',
                     'value_as_number', 'value_as_concept_id',
@@ -351,19 +443,13 @@ sql_import_dict = {
                     'unit_source_value', 'value_source_value'
                     ],
         'sql': None,
-        'table_name': "measurement",
-        'pk_query': """
-                SELECT count(*) as row_ct,
-                       count(measurement_id) as p_id,
-                       count(distinct measurement_id) as d_p_id
-                FROM measurement
-                """
+        'table_name': "measurement"
     },
     'Condition': {
         'column_list': [
-                    'condition_occurrence_id', ' person_id', 'condition_concept_id',
+                    'condition_occurrence_id', 'person_id', 'condition_concept_id',
                     'condition_start_date', 'condition_start_datetime',
-                    'condition_end_date', 'condition_end_datetime'
+                    'condition_end_date', 'condition_end_datetime',
                     'condition_type_concept_id',
                     'condition_status_concept_id',
                     'stop_reason',
@@ -373,12 +459,31 @@ sql_import_dict = {
                     'condition_status_source_concept_id', 'condition_status_source_value'
                     ],
         'sql': None,
-        'table_name': "condition_occurrence",
-        'pk_query': """### TODO
-                SELECT count(*) as row_ct,
-                       count(condition_occurrence_id) as p_id,
-                       count(distinct condition_occurrence_id) as d_p_id
-                FROM condition_occurrence
-                """
+        'table_name': "condition_occurrence"
     }
 }
+
+
+def pk_query(table_name: str, pk_column: str) -> str:
+    """ Row count, PK count and distinct PK count of a table, to check PK presence and uniqueness. """
+    return (f"SELECT count(*) as row_ct, count({pk_column}) as p_id, "
+            f"count(distinct {pk_column}) as d_p_id FROM {table_name}")
+
+
+# Column lists are never changed after this: keep them as tuples.
+# The PK is the first column of each table. The query is interned, so every user
+# of a table's pk_query holds the one canonical string.
+for details in sql_import_dict.values():
+    details['column_list'] = tuple(details['column_list'])
+    details['pk_query'] = sys.intern(pk_query(details['table_name'], details['column_list'][0]))
+
+
+# domain_name_to_table_name, its inverse table_name_to_domain, and sql_import_dict
+# are read-only lookup tables: intern their keys, those of each sql_import_dict
+# entry included, and wrap the tables so nothing downstream can change them.
+domain_name_to_table_name = MappingProxyType({sys.intern(k): v for k, v in domain_name_to_table_name.items()})
+table_name_to_domain = MappingProxyType({sys.intern(v): k for k, v in domain_name_to_table_name.items()})
+sql_import_dict = MappingProxyType({
+    sys.intern(domain): {sys.intern(k): v for k, v in details.items()}
+    for domain, details in sql_import_dict.items()
+})
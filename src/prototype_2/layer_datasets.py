@@ -29,7 +29,7 @@ import prototype_2.visit_reconcilliation as VR
 import prototype_2.value_transformations as VT
 import prototype_2.util as U
 from prototype_2.ddl import sql_import_dict
-from prototype_2.ddl import config_to_domain_name_dict
+from prototype_2.ddl import get_config_to_domain_name_dict
 from prototype_2.ddl import domain_name_to_table_name
 from prototype_2.metadata import get_meta_dict
 from prototype_2.domain_dataframe_column_types import domain_dataframe_column_types 
@@ -88,10 +88,11 @@ def find_max_columns(config_name :str, domain_list: list[ dict[str, tuple[ None
     """
     domain = None
     try:
-        domain = config_to_domain_name_dict[config_name]
+        domain = get_config_to_domain_name_dict()[config_name]
     except Exception as e:
-        logger.error(f"ERROR no domain for {config_name} in {config_to_domain_name_dict.keys()}"
-                     "The config_to_domain_name_dict in ddl.py probably needs this to be added to it.")
+        logger.error("ERROR no domain for %s in %s"
+                     "The config_to_domain_name_dict in ddl.py probably needs this to be added to it.",
+                     config_name, get_config_to_domain_name_dict().keys())
         raise e
 
     chosen_row =-1
@@ -180,7 +181,7 @@ def create_omop_domain_dataframes(omop_data: dict[str, list[ dict[str,  None | s
             try:
                 ##show_column_dict(config_name, column_dict)
                 domain_df = pd.DataFrame(column_dict)
-                domain_name = config_to_domain_name_dict[config_name]
+                domain_name = get_config_to_domain_name_dict()[config_name]
                 table_name = domain_name_to_table_name[domain_name]
                 if table_name in domain_dataframe_column_types.keys():
                     non_nullable_cols = NON_NULLABLE_COLUMNS.get(table_name, [])
@@ -265,12 +266,7 @@ def process_string(contents, filepath, write_csv_flag) -> dict[str, pd.DataFrame
     logger.info(f"--parsing string from file:{filepath} keys:{omop_data.keys()} p:{len(omop_data['Person'])} m:{len(omop_data['Measurement'])} ")
 
     # Visit FK reconciliation:
-    VR.assign_visit_occurrence_ids_to_events(omop_data)
-
-    if DO_VISIT_DETAIL:
-        if 'VISITDETAIL_visit_occurrence' in omop_data and omop_data['VISITDETAIL_visit_occurrence']:
-            logger.info("Starting visit_detail FK reconciliation")
-            VR.assign_visit_detail_ids_to_events(omop_data)
+    VR.assign_visit_ids_to_events(omop_data, DO_VISIT_DETAIL)
 
     logger.info(f"-- after reconcile parsing string from file:{filepath} keys:{omop_data.keys()} p:{len(omop_data['Person'])} m:{len(omop_data['Measurement'])} ")
     if omop_data is not None or len(omop_data) < 1:
@@ -327,12 +323,7 @@ def process_string_to_dict(contents, filepath, write_csv_flag, codemap_dict, vis
     omop_data = DDP.parse_string(contents, filepath, get_meta_dict())
 
     # Visit FK reconciliation:
-    VR.assign_visit_occurrence_ids_to_events(omop_data)
-
-    if DO_VISIT_DETAIL:
-        if 'VISITDETAIL_visit_occurrence' in omop_data and omop_data['VISITDETAIL_visit_occurrence']:
-            logger.info("Starting visit_detail FK reconciliation")
-            VR.assign_visit_detail_ids_to_events(omop_data)
+    VR.assign_visit_ids_to_events(omop_data, DO_VISIT_DETAIL)
 
     return omop_data
 
@@ -347,12 +338,7 @@ def process_file(filepath, write_csv_flag, parse_config :str) -> dict[str, pd.Da
     omop_data = DDP.parse_doc(filepath, get_meta_dict(), parse_config)
 
     # Visit FK reconciliation:
-    VR.assign_visit_occurrence_ids_to_events(omop_data)
-
-    if DO_VISIT_DETAIL:
-        if 'VISITDETAIL_visit_occurrence' in omop_data and omop_data['VISITDETAIL_visit_occurrence']:
-            logger.info("Starting visit_detail FK reconciliation")
-            VR.assign_visit_detail_ids_to_events(omop_data)
+    VR.assign_visit_ids_to_events(omop_data, DO_VISIT_DETAIL)
 
     # Convert from list of dictionaries/records to dataframes/datasets
     if omop_data is not None or len(omop_data) < 1:
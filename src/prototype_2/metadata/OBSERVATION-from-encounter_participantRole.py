@@ -1,5 +1,4 @@
 
-from numpy import int32
 import prototype_2.value_transformations as VT
 
 #541 
@@ -129,7 +128,7 @@ metadata = {
         
     	'observation_type_concept_id': {
             'config_type': 'CONSTANT',
-            'constant_value' : int32(32827),
+            'constant_value' : 32827,
             'order': 6
         },
     	'value_as_number': {
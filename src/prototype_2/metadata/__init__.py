@@ -4,6 +4,7 @@ import logging
 import sys
 import os
 import importlib.util
+from functools import cache
 from functools import reduce
 from typing import Dict, Any
 
@@ -86,7 +87,7 @@ def discover_and_sort_metadata() -> Dict[str, Any]:
         logging.error(f"Metadata directory not found at: {METADATA_DIR}")
         return {}
             
-    files_to_skip = ['__init__.py', 'test.py', 'ddl.py', 'util.py', 
+    files_to_skip = ['__init__.py', '_domain_manifest.py', 'test.py', 'ddl.py', 'util.py', 
         'test' # (though a dir, still needs to be skipped, getting an error about test.py?
     ]
     filenames = os.listdir(METADATA_DIR)
@@ -114,7 +115,12 @@ def discover_and_sort_metadata() -> Dict[str, Any]:
     return reduce(lambda a, b: a | b, metadata_dicts)
 
 
+@cache
 def get_meta_dict():
+    """ Loads the metadata once per process and returns the same dict after that,
+        so per-file callers, and each worker process in data_driven_parse.main(),
+        don't re-execute every metadata module. Treat the result as read-only.
+    """
     metadata = discover_and_sort_metadata()
 
     # Don't apply user mappings if we can't be sure we're not running in master.
@@ -0,0 +1,56 @@
+# Generated by bin/regen_manifest.sh from the metadata modules, don't edit.
+# Regenerate it after adding a config or changing an expected_domain_id.
+
+MANIFEST = {
+    'Care_Site_ee': 'Care_Site',
+    'Care_Site_pr': 'Care_Site',
+    'Condition': 'Condition',
+    'DEVICE-from-act_observation_playingEntity': 'Device',
+    'DEVICE-from-medications_consumable': 'Device',
+    'DEVICE-from-medications_nested_substanceAdministration': 'Device',
+    'DEVICE-from-medications_substance_administration': 'Device',
+    'DEVICE-from-medications_supply': 'Device',
+    'DEVICE-from-procedures': 'Device',
+    'Device_organizer_procedure': 'Device',
+    'Device_organizer_supply': 'Device',
+    'Device_procedure': 'Device',
+    'Device_supply': 'Device',
+    'Immunization_immunization_activity': 'Drug',
+    'Location': 'Location',
+    'Location_ee': 'Location',
+    'Location_pr': 'Location',
+    'MEASUREMENT-from-plan-of-tmt_observation': 'Measurement',
+    'MEASUREMENT-from-procedure_act': 'Measurement',
+    'MEASUREMENT-from-procedure_procedure': 'Measurement',
+    'MEASUREMENT-from-results_organizer_observation': 'Measurement',
+    'MEASUREMENT-from-results_procedure': 'Measurement',
+    'MEASUREMENT-from-vital_signs_organizer_observation': 'Measurement',
+    'Medication_medication_activity': 'Drug',
+    'Medication_medication_dispense': 'Drug',
+    'OBSERVATION-from-Encounter': 'Observation',
+    'OBSERVATION-from-Encounter_participantRole': 'Observation',
+    'OBSERVATION-from-Procedure': 'Observation',
+    'OBSERVATION-from-assessments': 'Observation',
+    'OBSERVATION-from-assessments_act': 'Observation',
+    'OBSERVATION-from-procedure_act': 'Observation',
+    'Observation': 'Observation',
+    'Observation_social_history_cultural': 'Observation',
+    'Observation_social_history_home_environment': 'Observation',
+    'Observation_social_history_pregnancy': 'Observation',
+    'Observation_social_history_smoking': 'Observation',
+    'Observation_social_history_tobacco_use': 'Observation',
+    'PROCEDURE-from-Immunization_manufactured_material': 'Procedure',
+    'PROCEDURE-from-encounter_encounter': 'Procedure',
+    'PROCEDURE-from-procedure_act': 'Procedure',
+    'PROCEDURE-from-procedure_observation': 'Procedure',
+    'PROCEDURE-from-procedure_procedure': 'Procedure',
+    'PROCEDURE-from-results_observation': 'Procedure',
+    'PROCEDURE-from-results_procedure': 'Procedure',
+    'PROVIDER-from-encompassingEncounter_encounterParticipant': 'Provider',
+    'PROVIDER-from-encompassingEncounter_responsibleParty': 'Provider',
+    'PROVIDER-from-encounter_performer_assignedEntity': 'Provider',
+    'PROVIDER-from-serviceEvent_performer': 'Provider',
+    'Person': 'Person',
+    'Visit': 'Visit',
+    'Visit_encompassingEncounter': 'Visit',
+}
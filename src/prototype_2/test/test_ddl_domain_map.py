@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prototype_2 import ddl as DDL
+
+
+class DomainMapTest(unittest.TestCase):
+
+    def test_map_has_known_configs(self):
+        domain_map = DDL.generate_cfg_name_to_domain_map()
+        self.assertEqual(domain_map['Visit'], 'Visit')
+        self.assertEqual(domain_map['Condition'], 'Condition')
+        self.assertEqual(domain_map['MEASUREMENT-from-results_procedure'], 'Measurement')
+
+
+class DomainManifestTest(unittest.TestCase):
+
+    def test_manifest_is_up_to_date(self):
+        scanned = DDL.generate_cfg_name_to_domain_map()
+        self.assertEqual(DDL.load_domain_manifest(), scanned, "run bin/regen_manifest.sh")
+
+    def test_scans_without_a_manifest(self):
+        DDL.get_config_to_domain_name_dict.cache_clear()
+        try:
+            with mock.patch.object(DDL, 'load_domain_manifest', return_value=None), \
+                    mock.patch.object(DDL, 'generate_cfg_name_to_domain_map', return_value={'X': 'Drug'}):
+                self.assertEqual(DDL.get_config_to_domain_name_dict(), {'X': 'Drug'})
+        finally:
+            DDL.get_config_to_domain_name_dict.cache_clear()
+
+
+class MetadataFileFilterTest(unittest.TestCase):
+
+    def test_only_plain_modules_are_kept(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ('visit.py', '__init__.py', '.#visit.py', '_draft.py', 'notes.txt'):
+                open(os.path.join(tmp_dir, name), 'w').close()
+            os.mkdir(os.path.join(tmp_dir, 'dir.py'))
+            with os.scandir(tmp_dir) as entries:
+                kept = [e.name for e in entries if DDL.is_metadata_file(e)]
+        self.assertEqual(kept, ['visit.py'])
+
+
+class MetadataModuleErrorTest(unittest.TestCase):
+
+    def load(self, source):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'broken.py')
+            with open(file_path, 'w') as metadata_file:
+                metadata_file.write(source)
+            return DDL.domains_from_metadata_module('broken.py', file_path)
+
+    def test_malformed_module_is_logged_and_skipped(self):
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.load("metadata = {'X': {'root': {\n"), {})
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(self.load("import no_such_metadata_helper\n"), {})
+
+    def test_other_errors_propagate(self):
+        with self.assertRaises(NameError):
+            self.load("metadata = {'X': {'root': {'expected_domain_id': UNDEFINED}}}\n")
+
+
+class DomainMapFromSourceTest(unittest.TestCase):
+
+    def test_source_matches_executed_module_for_every_file(self):
+        with os.scandir(DDL.METADATA_DIR) as entries:
+            metadata_files = sorted((e.name, e.path) for e in entries if DDL.is_metadata_file(e))
+        self.assertTrue(metadata_files)
+        for filename, file_path in metadata_files:
+            with open(file_path, 'rb') as metadata_file:
+                from_source = DDL.domains_from_metadata_source(filename, metadata_file.read())
+            self.assertEqual(from_source, DDL.domains_from_metadata_module(filename, file_path), filename)
+
+    def test_unexpected_shape_is_left_to_execution(self):
+        built = b"metadata = {}\nmetadata['X'] = {'root': {'expected_domain_id': 'Drug'}}\n"
+        self.assertIsNone(DDL.domains_from_metadata_source('built.py', built))
+        computed = b"NAME = 'X'\nmetadata = {NAME: {'root': {'expected_domain_id': 'Drug'}}}\n"
+        self.assertIsNone(DDL.domains_from_metadata_source('computed.py', computed))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import sys
+import unittest
+
+from prototype_2 import ddl as DDL
+
+
+class DDLTablesTest(unittest.TestCase):
+
+    def test_lookup_tables_are_read_only(self):
+        with self.assertRaises(TypeError):
+            DDL.domain_name_to_table_name['Note'] = 'note'
+        with self.assertRaises(TypeError):
+            DDL.sql_import_dict['Note'] = {}
+
+    def test_every_domain_has_a_table(self):
+        for domain, details in DDL.sql_import_dict.items():
+            self.assertEqual(DDL.domain_name_to_table_name[domain], details['table_name'])
+
+    def test_table_name_maps_back_to_its_domain(self):
+        self.assertEqual(len(DDL.table_name_to_domain), len(DDL.domain_name_to_table_name))
+        for domain, table_name in DDL.domain_name_to_table_name.items():
+            self.assertEqual(DDL.table_name_to_domain[table_name], domain)
+        with self.assertRaises(TypeError):
+            DDL.table_name_to_domain['note'] = 'Note'
+
+    def test_column_lists_are_tuples_of_bare_names(self):
+        for domain, details in DDL.sql_import_dict.items():
+            self.assertIsInstance(details['column_list'], tuple, domain)
+            for column in details['column_list']:
+                self.assertRegex(column, r'^[a-z0-9_]+$', domain)
+
+    def test_pk_query_counts_the_first_column(self):
+        details = DDL.sql_import_dict['Condition']
+        self.assertEqual(details['pk_query'],
+                         "SELECT count(*) as row_ct, count(condition_occurrence_id) as p_id, "
+                         "count(distinct condition_occurrence_id) as d_p_id FROM condition_occurrence")
+
+    def test_pk_queries_are_interned(self):
+        for details in DDL.sql_import_dict.values():
+            query = DDL.pk_query(details['table_name'], details['column_list'][0])
+            self.assertIs(details['pk_query'], sys.intern(query))
+
+
+if __name__ == '__main__':
+    unittest.main()
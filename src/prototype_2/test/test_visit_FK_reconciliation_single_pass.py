@@ -0,0 +1,201 @@
+import unittest
+import datetime
+from unittest import mock
+import prototype_2.visit_reconcilliation  as VR
+
+MEASUREMENT_CFG = 'MEASUREMENT-from-results_procedure'
+
+
+# Linear scans the batch matchers are checked against: every event against every window.
+
+def holds(start, end, window_start, window_end):
+    return window_start <= start <= window_end and window_start <= end <= window_end
+
+
+def kind_of(start, end):
+    """ 'datetime' or 'date' for the fields an event is compared with, None for a mix or other types. """
+    start_is_dt = isinstance(start, datetime.datetime)
+    end_is_dt = isinstance(end, datetime.datetime)
+    if start_is_dt and end_is_dt:
+        return 'datetime'
+    if start_is_dt or end_is_dt or not isinstance(start, datetime.date) or not isinstance(end, datetime.date):
+        return None
+    return 'date'
+
+
+def visits_holding(start, end, visits):
+    """ A visit whose start and end datetimes are equal runs to 23:59:59 on its end date. """
+    kind = kind_of(start, end)
+    matches = []
+    for visit in visits:
+        visit_start = visit.get(f"visit_start_{kind}")
+        visit_end = visit.get(f"visit_end_{kind}")
+        if kind is None or visit_start is None or visit_end is None:
+            continue
+        if kind == 'datetime' and visit_start == visit_end:
+            visit_end = datetime.datetime.combine(visit["visit_end_date"], datetime.time(23, 59, 59))
+        if holds(start, end, visit_start, visit_end):
+            matches.append(visit["visit_occurrence_id"])
+    return matches
+
+
+def shortest_visit_detail_holding(start, end, visit_details):
+    """ The first listed on a tie; no end-of-day adjustment. """
+    kind = kind_of(start, end)
+    matches = [vd for vd in visit_details
+               if kind is not None and vd.get(f"visit_detail_start_{kind}") and vd.get(f"visit_detail_end_{kind}")
+               and holds(start, end, vd[f"visit_detail_start_{kind}"], vd[f"visit_detail_end_{kind}"])]
+    return min(matches, key=VR.get_visit_detail_duration, default=None)
+
+
+class TestSinglePassVisitReconciliation(unittest.TestCase):
+
+    def setUp(self):
+        self.visits = [{
+            "visit_occurrence_id": 1,
+            "visit_start_date": datetime.date(2025, 9, 1),
+            "visit_start_datetime": datetime.datetime(2025, 9, 1, 8, 0, 0),
+            "visit_end_date": datetime.date(2025, 9, 5),
+            "visit_end_datetime": datetime.datetime(2025, 9, 5, 17, 0, 0),
+        }]
+        self.visit_details = [
+            {
+                "visit_detail_id": 10,
+                "visit_occurrence_id": 1,
+                "visit_detail_start_date": datetime.date(2025, 9, 1),
+                "visit_detail_start_datetime": datetime.datetime(2025, 9, 1, 9, 0, 0),
+                "visit_detail_end_date": datetime.date(2025, 9, 3),
+                "visit_detail_end_datetime": datetime.datetime(2025, 9, 3, 9, 0, 0),
+            },
+            {
+                "visit_detail_id": 11,
+                "visit_occurrence_id": 1,
+                "visit_detail_start_date": datetime.date(2025, 9, 2),
+                "visit_detail_start_datetime": datetime.datetime(2025, 9, 2, 9, 0, 0),
+                "visit_detail_end_date": datetime.date(2025, 9, 2),
+                "visit_detail_end_datetime": datetime.datetime(2025, 9, 2, 12, 0, 0),
+            },
+        ]
+
+    def measurement(self, when):
+        return {
+            "measurement_id": 100,
+            "measurement_date": when.date(),
+            "measurement_datetime": when,
+            "visit_occurrence_id": None,
+            "visit_detail_id": None,
+        }
+
+    def test_sets_both_fks_choosing_shortest_visit_detail(self):
+        data = {
+            'Visit': self.visits,
+            'VISITDETAIL_visit_occurrence': self.visit_details,
+            MEASUREMENT_CFG: [self.measurement(datetime.datetime(2025, 9, 2, 10, 0, 0))],
+        }
+        VR.assign_visit_ids_to_events(data)
+        self.assertEqual(data[MEASUREMENT_CFG][0]["visit_occurrence_id"], 1)
+        self.assertEqual(data[MEASUREMENT_CFG][0]["visit_detail_id"], 11)
+
+    def test_visit_detail_skipped_when_turned_off(self):
+        data = {
+            'Visit': self.visits,
+            'VISITDETAIL_visit_occurrence': self.visit_details,
+            MEASUREMENT_CFG: [self.measurement(datetime.datetime(2025, 9, 2, 10, 0, 0))],
+        }
+        VR.assign_visit_ids_to_events(data, False)
+        self.assertEqual(data[MEASUREMENT_CFG][0]["visit_occurrence_id"], 1)
+        self.assertIsNone(data[MEASUREMENT_CFG][0]["visit_detail_id"])
+
+    def test_no_visit_detail_outside_details(self):
+        data = {
+            'Visit': self.visits,
+            'VISITDETAIL_visit_occurrence': self.visit_details,
+            MEASUREMENT_CFG: [self.measurement(datetime.datetime(2025, 9, 4, 10, 0, 0))],
+        }
+        VR.assign_visit_ids_to_events(data)
+        self.assertEqual(data[MEASUREMENT_CFG][0]["visit_occurrence_id"], 1)
+        self.assertIsNone(data[MEASUREMENT_CFG][0]["visit_detail_id"])
+
+    def test_batch_matches_each_event_alone(self):
+        visits = self.visits + [{
+            "visit_occurrence_id": 2,
+            "visit_start_date": datetime.date(2025, 9, 4),
+            "visit_start_datetime": datetime.datetime(2025, 9, 4, 12, 0, 0),
+            "visit_end_date": datetime.date(2025, 9, 4),
+            "visit_end_datetime": datetime.datetime(2025, 9, 4, 12, 0, 0),
+        }]
+        event_windows = [
+            (datetime.datetime(2025, 9, 2, 10, 0, 0), datetime.datetime(2025, 9, 2, 10, 0, 0)),
+            (datetime.datetime(2025, 9, 4, 20, 0, 0), datetime.datetime(2025, 9, 4, 21, 0, 0)),
+            (datetime.date(2025, 9, 4), datetime.date(2025, 9, 4)),
+            (datetime.datetime(2025, 9, 4, 20, 0, 0), datetime.date(2025, 9, 4)),
+            (datetime.datetime(2025, 10, 1, 0, 0, 0), datetime.datetime(2025, 10, 1, 0, 0, 0)),
+            (datetime.datetime(2025, 9, 4, 21, 0, 0), datetime.datetime(2025, 9, 4, 20, 0, 0)),
+            (datetime.datetime(2025, 9, 6, 0, 0, 0), datetime.datetime(2025, 9, 4, 20, 0, 0)),
+            ("2025-09-04", "2025-09-04"),
+            (None, None),
+        ]
+        batch = VR.match_prepared_visit_occurrences_batch(event_windows, VR.prepare_visit_windows(visits))
+        expected = [visits_holding(start, end, visits) for start, end in event_windows[:-1]]
+        self.assertEqual(batch, expected + [None])
+        self.assertEqual(batch[-2], [])
+        self.assertEqual(batch[:3], [[1], [1, 2], [1, 2]])
+        self.assertEqual(batch[5:7], [[1, 2], []])
+
+    def test_sorted_windows_keep_bounds_and_visit_order(self):
+        day = datetime.datetime(2025, 9, 1)
+        # listed out of start order, nested and overlapping
+        bounds = [(5, 9), (0, 30), (5, 6), (2, 9), (9, 12), (0, 5)]
+        visits = [{
+            "visit_occurrence_id": i,
+            "visit_start_date": (day + datetime.timedelta(hours=start)).date(),
+            "visit_start_datetime": day + datetime.timedelta(hours=start),
+            "visit_end_date": (day + datetime.timedelta(hours=end)).date(),
+            "visit_end_datetime": day + datetime.timedelta(hours=end),
+        } for i, (start, end) in enumerate(bounds)]
+        hours = [(h, h) for h in range(-1, 32)] + [(5, 9), (9, 5), (0, 12), (4, 6)]
+        event_windows = [(day + datetime.timedelta(hours=s), day + datetime.timedelta(hours=e)) for s, e in hours]
+        batch = VR.match_prepared_visit_occurrences_batch(event_windows, VR.prepare_visit_windows(visits))
+        self.assertEqual(batch, [visits_holding(start, end, visits) for start, end in event_windows])
+        self.assertEqual(batch[hours.index((5, 5))], [0, 1, 2, 3, 5])
+        self.assertEqual(batch[hours.index((9, 5))], [0, 1, 3])
+
+        with mock.patch.object(VR, 'MATCH_CANDIDATE_LIMIT', 2):
+            self.assertEqual(VR.match_prepared_visit_occurrences_batch(event_windows, VR.prepare_visit_windows(visits)), batch)
+
+    def test_prepared_visit_detail_matches_linear_scan(self):
+        day = datetime.datetime(2025, 9, 1)
+        # nested, overlapping, a tie (2 and 5), one without a start datetime;
+        # the same hours again for visit_occurrence 2, shifted a day on
+        bounds = [(5, 9), (0, 30), (5, 6), (2, 9), (9, 12), (5, 6)]
+        visit_details = [{
+            "visit_detail_id": voc_id * 10 + i,
+            "visit_occurrence_id": voc_id,
+            "visit_detail_start_date": (day + datetime.timedelta(days=voc_id, hours=start)).date(),
+            "visit_detail_start_datetime": day + datetime.timedelta(days=voc_id, hours=start),
+            "visit_detail_end_date": (day + datetime.timedelta(days=voc_id, hours=end)).date(),
+            "visit_detail_end_datetime": day + datetime.timedelta(days=voc_id, hours=end),
+        } for voc_id in (1, 2) for i, (start, end) in enumerate(bounds)]
+        visit_details[3]["visit_detail_start_datetime"] = None
+        hours = [(h, h) for h in range(-1, 56)] + [(5, 9), (9, 5), (0, 12), (4, 6), (29, 30)]
+        event_windows = [(day + datetime.timedelta(hours=s), day + datetime.timedelta(hours=e)) for s, e in hours]
+        event_windows += [(day.date(), day.date()), (day.date(), (day + datetime.timedelta(days=1)).date()),
+                          (day, day.date()), (None, None)]
+        detail_windows = VR.prepare_visit_detail_windows(visit_details)
+        for voc_id in (1, 2, 3, None):
+            same_visit = [vd for vd in visit_details if vd["visit_occurrence_id"] == voc_id]
+            expected = [shortest_visit_detail_holding(start, end, same_visit) if start else None
+                        for start, end in event_windows]
+            voc_ids = [voc_id] * len(event_windows)
+            batch = VR.match_most_specific_prepared_visit_details_batch(event_windows, voc_ids, detail_windows)
+            self.assertEqual([id(vd) for vd in batch], [id(vd) for vd in expected])
+            with mock.patch.object(VR, 'MATCH_CANDIDATE_LIMIT', 2):
+                self.assertEqual(VR.match_most_specific_prepared_visit_details_batch(event_windows, voc_ids, detail_windows), batch)
+        mixed = [(day + datetime.timedelta(hours=29), day + datetime.timedelta(hours=30)),
+                 (day + datetime.timedelta(hours=53), day + datetime.timedelta(hours=54)),
+                 (day + datetime.timedelta(hours=29), day + datetime.timedelta(hours=30))]
+        batch = VR.match_most_specific_prepared_visit_details_batch(mixed, [1, 2, 2], detail_windows)
+        self.assertEqual([vd and vd["visit_detail_id"] for vd in batch], [12, 22, None])
+
+if __name__ == "__main__":
+    unittest.main()
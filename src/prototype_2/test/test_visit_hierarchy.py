@@ -0,0 +1,124 @@
+import unittest
+import datetime
+from numpy import int64
+import prototype_2.visit_reconcilliation  as VR
+
+INPATIENT = 9201
+OUTPATIENT = 9202
+
+def visit(visit_id, start, end, concept_id=INPATIENT, person_id=1):
+    return {
+        "visit_occurrence_id": int64(visit_id),
+        "person_id": person_id,
+        "visit_concept_id": concept_id,
+        "visit_start_date": start.date(),
+        "visit_start_datetime": start,
+        "visit_end_date": end.date(),
+        "visit_end_datetime": end,
+        "cfg_name": "Visit",
+    }
+
+class TestVisitHierarchy(unittest.TestCase):
+
+    def setUp(self):
+        self.stay = visit(1, datetime.datetime(2025, 9, 1, 8), datetime.datetime(2025, 9, 20, 8))
+        self.icu = visit(2, datetime.datetime(2025, 9, 3, 8), datetime.datetime(2025, 9, 10, 8))
+        self.consult = visit(3, datetime.datetime(2025, 9, 5, 9), datetime.datetime(2025, 9, 5, 10), OUTPATIENT)
+
+    def details_by_id(self, data):
+        return {vd["visit_detail_id"]: vd for vd in data.get("VISITDETAIL_visit_occurrence", [])}
+
+    def test_nested_chain_uses_most_specific_parent(self):
+        data = VR.reclassify_nested_visit_occurrences_as_detail({"Visit": [self.stay, self.icu, self.consult]})
+        self.assertEqual([v["visit_occurrence_id"] for v in data["Visit"]], [1])
+        details = self.details_by_id(data)
+        self.assertEqual(details[2]["visit_occurrence_id"], 1)
+        self.assertIsNone(details[2]["visit_detail_parent_id"])
+        self.assertEqual(details[3]["visit_occurrence_id"], 1)
+        self.assertEqual(details[3]["visit_detail_parent_id"], 2)
+
+    def test_overlapping_sibling_parents_leave_child_in_place(self):
+        other = visit(4, datetime.datetime(2025, 9, 4, 8), datetime.datetime(2025, 9, 25, 8))
+        parents = [self.stay, other]
+        self.assertIsNone(VR.find_most_specific_prepared_parent(self.consult, VR.prepare_parent_windows(parents)))
+
+    def test_parents_are_per_person(self):
+        self.consult["person_id"] = 2
+        parents = [self.stay, self.icu]
+        self.assertIsNone(VR.find_most_specific_prepared_parent(self.consult, VR.prepare_parent_windows(parents)))
+        self.consult["person_id"] = 1
+        self.assertEqual(VR.find_most_specific_prepared_parent(self.consult, VR.prepare_parent_windows(parents)), 2)
+
+    def test_timezone_aware_and_naive_visits_nest(self):
+        utc = datetime.timezone.utc
+        self.stay["visit_start_datetime"] = self.stay["visit_start_datetime"].replace(tzinfo=utc)
+        self.stay["visit_end_datetime"] = self.stay["visit_end_datetime"].replace(tzinfo=utc)
+        data = VR.reclassify_nested_visit_occurrences_as_detail({"Visit": [self.stay, self.icu]})
+        self.assertEqual([v["visit_occurrence_id"] for v in data["Visit"]], [1])
+        self.assertIsNone(data["Visit"][0]["visit_start_datetime"].tzinfo)
+        self.assertEqual(self.details_by_id(data)[2]["visit_occurrence_id"], 1)
+
+    def test_duplicate_encompassing_encounter_yields_to_visit(self):
+        encounter = dict(self.icu, cfg_name="Visit_encompassingEncounter", visit_source_value="encounter")
+        data = VR.reclassify_nested_visit_occurrences_as_detail(
+            {"Visit_encompassingEncounter": [encounter, self.consult], "Visit": [self.stay, self.icu]})
+        self.assertNotIn("Visit_encompassingEncounter", data)
+        details = self.details_by_id(data)
+        self.assertEqual(sorted(details), [2, 3])
+        self.assertEqual(details[2]["cfg_name"], "Visit")
+        self.assertEqual(details[3]["visit_detail_parent_id"], 2)
+
+    def test_equally_long_parents_pick_the_first_listed(self):
+        twin = visit(5, self.icu["visit_start_datetime"], self.icu["visit_end_datetime"])
+        for parents, expected in (([twin, self.stay, self.icu], 5), ([self.stay, self.icu, twin], 2)):
+            self.assertEqual(VR.find_most_specific_prepared_parent(self.consult, VR.prepare_parent_windows(parents)), expected)
+
+    def test_date_only_visit_nests_under_a_later_parent_with_datetimes(self):
+        date_only = visit(6, self.stay["visit_start_datetime"], self.stay["visit_end_datetime"])
+        del date_only["visit_start_datetime"], date_only["visit_end_datetime"]
+        data = VR.reclassify_nested_visit_occurrences_as_detail({"Visit": [date_only, self.stay]})
+        self.assertEqual(data["Visit"], [self.stay])
+        details = self.assert_single_visit_without_cycles(data)
+        self.assertEqual(sorted(details), [6])
+
+    def test_top_level_parent_is_cached_along_the_chain(self):
+        cache = {}
+        parents = {4: 3, 3: 2, 2: 1}
+        self.assertEqual(VR.find_top_level_parent(4, parents, cache), 1)
+        self.assertEqual(cache, {4: 1, 3: 1, 2: 1})
+        self.assertEqual(VR.find_top_level_parent(1, parents, cache), 1)
+
+    def assert_single_visit_without_cycles(self, data):
+        self.assertEqual(len(data["Visit"]), 1)
+        top_level_id = data["Visit"][0]["visit_occurrence_id"]
+        details = self.details_by_id(data)
+        for detail_id, detail in details.items():
+            self.assertEqual(detail["visit_occurrence_id"], top_level_id)
+            seen = {detail_id}
+            parent_id = detail["visit_detail_parent_id"]
+            while parent_id is not None:
+                self.assertNotIn(parent_id, seen)
+                seen.add(parent_id)
+                parent_id = details[parent_id]["visit_detail_parent_id"]
+        return details
+
+    def test_identical_inpatient_visits_terminate(self):
+        twin = visit(5, self.stay["visit_start_datetime"], self.stay["visit_end_datetime"])
+        data = VR.reclassify_nested_visit_occurrences_as_detail({"Visit": [self.stay, twin]})
+        self.assertEqual(data["Visit"], [self.stay])
+        details = self.assert_single_visit_without_cycles(data)
+        self.assertEqual(sorted(details), [5])
+        self.assertIsNone(details[5]["visit_detail_parent_id"])
+
+    def test_identical_nested_visits_chain_to_the_first_listed(self):
+        noon = datetime.datetime(2025, 1, 3, 12)
+        visits = [visit(13, datetime.datetime(2025, 1, 1, 8), datetime.datetime(2025, 1, 9, 8)),
+                  visit(14, noon, noon), visit(16, noon, noon)]
+        data = VR.reclassify_nested_visit_occurrences_as_detail({"Visit": visits})
+        self.assertEqual([v["visit_occurrence_id"] for v in data["Visit"]], [13])
+        details = self.assert_single_visit_without_cycles(data)
+        self.assertIsNone(details[14]["visit_detail_parent_id"])
+        self.assertEqual(details[16]["visit_detail_parent_id"], 14)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,7 @@
 
 from collections import defaultdict
 import logging 
+import os
 from typeguard import typechecked
 from dateutil.parser import parse
 import datetime
@@ -13,6 +14,12 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
+
+# typeguard's runtime checks walk the large record annotations on every call, which
+# dominates the per-element and per-event paths. This decorator only applies them when
+# DDP_TYPECHECK is set (bin/test.sh does), and never under python -O.
+typechecked_if_enabled = typechecked if __debug__ and os.environ.get('DDP_TYPECHECK') else (lambda f: f)
+
 """
     These three functions create dictionaries from the vocabulary xwalk 
     pandas dataframes.
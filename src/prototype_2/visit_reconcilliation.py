@@ -6,8 +6,7 @@
     as well as functions to differentiate visit_occurrence from visit_detail.
 
     Main entry points are:
-    - assign_visit_occurrence_ids_to_events()
-    - assign_visit_detail_ids_to_events()
+    - assign_visit_ids_to_events()
     - reclassify_nested_visit_occurrences_as_detail()
 
     This code processes visit data to create a hierarchical structure
@@ -23,13 +22,20 @@
 """
 import datetime
 import logging
+from bisect import bisect_right
+from functools import cache
+from operator import itemgetter
+import numpy as np
 from numpy import int64
-from typeguard import typechecked
 from prototype_2 import ddl as DDL
+from prototype_2.util import typechecked_if_enabled as _typechecked
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.ERROR)
 
+# Runtime type checks (see util.typechecked_if_enabled) are only on the per-document
+# entry points: the per-visit and per-candidate helpers go unchecked.
+
 
 
 
@@ -45,24 +51,32 @@ INPATIENT_CONCEPT_IDS = {
 MAX_PARENT_DURATION_DAYS = 367
 
 
-@typechecked
-def get_visit_duration_days(visit_dict: OMOPRecord) -> float | None:
+VISIT_HIERARCHY_DATETIME_KEYS = ('visit_start_datetime', 'visit_end_datetime')
+VISIT_HIERARCHY_DATE_KEYS = ('visit_start_date', 'visit_end_date')
+
+
+def _hierarchy_keys(visit_dict):
+    """ The (start, end) keys get_visit_duration_days() and is_temporally_contained() read
+        for this visit (as the child): its datetimes when it has both fields, else its dates.
+    """
+    if 'visit_start_datetime' in visit_dict and 'visit_end_datetime' in visit_dict:
+        return VISIT_HIERARCHY_DATETIME_KEYS
+    return VISIT_HIERARCHY_DATE_KEYS
+
+
+def get_visit_duration_days(visit_dict: OMOPRecord, keys: tuple[str, str] | None = None) -> float | None:
     """
     Calculate visit duration in days.
 
     Args:
         visit_dict: Dictionary containing visit record
+        keys: _hierarchy_keys(visit_dict), when the caller already has them
 
     Returns:
         Duration in days, or None if dates are missing
     """
     # Try datetime columns first, fall back to date columns
-    if 'visit_start_datetime' in visit_dict and 'visit_end_datetime' in visit_dict:
-        start_key = 'visit_start_datetime'
-        end_key = 'visit_end_datetime'
-    else:
-        start_key = 'visit_start_date'
-        end_key = 'visit_end_date'
+    start_key, end_key = keys or _hierarchy_keys(visit_dict)
 
     start = visit_dict.get(start_key)
     end = visit_dict.get(end_key)
@@ -83,8 +97,9 @@ def get_visit_duration_days(visit_dict: OMOPRecord) -> float | None:
         return None
 
 
-@typechecked
-def identify_inpatient_parents(visit_list: list[OMOPRecord]) -> list[OMOPRecord]:
+@_typechecked
+def identify_inpatient_parents(visit_list: list[OMOPRecord],
+                               durations: dict | None = None) -> list[OMOPRecord]:
     """
     Identify inpatient parent visits that are meaningful and time-bounded.
 
@@ -95,6 +110,8 @@ def identify_inpatient_parents(visit_list: list[OMOPRecord]) -> list[OMOPRecord]
 
     Args:
         visit_list: List of visit record dictionaries
+        durations: if given, filled with id(parent) → its get_visit_duration_days(),
+            for prepare_parent_windows() to reuse
 
     Returns:
         List containing only eligible inpatient parent visits
@@ -115,31 +132,29 @@ def identify_inpatient_parents(visit_list: list[OMOPRecord]) -> list[OMOPRecord]
                 # Check duration threshold
                 if duration_days < MAX_PARENT_DURATION_DAYS:
                     eligible_parents.append(visit)
+                    if durations is not None:
+                        durations[id(visit)] = duration_days
 
     logger.info(f"Identified {len(eligible_parents)} inpatient parent visits from {len(visit_list)} total visits")
 
     return eligible_parents
 
 
-@typechecked
-def is_temporally_contained(child_dict: OMOPRecord, parent_dict: OMOPRecord) -> bool:
+def is_temporally_contained(child_dict: OMOPRecord, parent_dict: OMOPRecord,
+                            keys: tuple[str, str] | None = None) -> bool:
     """
     Check if child visit is temporally contained within parent visit.
 
     Args:
         child_dict: Child visit record
         parent_dict: Parent visit record
+        keys: _hierarchy_keys(child_dict), when the caller already has them
 
     Returns:
         True if child is fully contained within parent timeframe
     """
     # Determine which date columns to use
-    if 'visit_start_datetime' in child_dict and 'visit_end_datetime' in child_dict:
-        start_key = 'visit_start_datetime'
-        end_key = 'visit_end_datetime'
-    else:
-        start_key = 'visit_start_date'
-        end_key = 'visit_end_date'
+    start_key, end_key = keys or _hierarchy_keys(child_dict)
 
     child_start = child_dict.get(start_key)
     child_end = child_dict.get(end_key)
@@ -159,92 +174,160 @@ def is_temporally_contained(child_dict: OMOPRecord, parent_dict: OMOPRecord) ->
     return parent_start <= child_start and parent_end >= child_end
 
 
-@typechecked
-def find_most_specific_parent(child_dict: OMOPRecord,
-                              potential_parents: list[OMOPRecord]) -> int64 | None:
+def prepare_parent_windows(parent_visits, durations: dict | None = None):
     """
-    Find the most specific (shortest duration, most immediate) parent for a child visit.
-
-    When multiple parents overlap and contain a child, choose the parent with the
-    shortest duration as it represents the most specific/immediate context.
+    Indexes parents, once per document, for find_most_specific_prepared_parent():
+    {(person_id, keys): (starts, entries)} for both kinds of keys, with entries
+    sorted by start and starts their start values, for bisecting. An entry is
+    (start, end, duration, index, parent's own keys, parent), duration from
+    get_visit_duration_days() and index the parent's list position. Datetimes must
+    already be tz-naive (_normalize_datetimes). A parent missing either value for a
+    kind of keys isn't indexed under them.
+    durations, from identify_inpatient_parents(), saves working them out again.
+    """
+    if durations is None:
+        durations = {}
+    parent_windows = {}
+    for index, parent in enumerate(parent_visits):
+        own_keys = _hierarchy_keys(parent)
+        duration = durations.get(id(parent))
+        if duration is None:
+            duration = get_visit_duration_days(parent, own_keys)
+        for keys in (VISIT_HIERARCHY_DATETIME_KEYS, VISIT_HIERARCHY_DATE_KEYS):
+            start = parent.get(keys[0])
+            end = parent.get(keys[1])
+            if start is not None and end is not None:
+                entry = (start, end, duration, index, own_keys, parent)
+                parent_windows.setdefault((parent.get('person_id'), keys), []).append(entry)
+
+    for bucket_key, entries in parent_windows.items():
+        entries.sort(key=itemgetter(0))
+        parent_windows[bucket_key] = ([entry[0] for entry in entries], entries)
+    return parent_windows
+
+
+def _find_sibling_parents(containing, keys):
+    """
+    A pair of the containing parents where neither contains the other, or None when
+    they form a chain. When every parent reads the same keys as the child, the windows
+    are already at hand: sorted by start, and by end descending within a start, a chain
+    is one where each window holds the next. Otherwise every pair is checked with
+    is_temporally_contained(), each parent read with its own keys.
+    """
+    if all(entry[4] == keys for entry in containing):
+        ordered = sorted(sorted(containing, key=itemgetter(1), reverse=True), key=itemgetter(0))
+        for outer, inner in zip(ordered, ordered[1:]):
+            if outer[1] < inner[1]:
+                return outer, inner
+        return None
 
-    However, if the child has multiple containing parents that are at the same
-    hierarchy level (i.e., the parents don't contain each other), returns None
-    to avoid ambiguity. The child visit will remain at its current level.
+    for i in range(len(containing)):
+        for j in range(i + 1, len(containing)):
+            parent_i, keys_i = containing[i][5], containing[i][4]
+            parent_j, keys_j = containing[j][5], containing[j][4]
+            if (not is_temporally_contained(parent_j, parent_i, keys_j)
+                    and not is_temporally_contained(parent_i, parent_j, keys_i)):
+                return containing[i], containing[j]
+    return None
 
-    Args:
-        child_dict: Child visit record
-        potential_parents: List of potential parent visit records
 
-    Returns:
-        visit_occurrence_id of the most specific parent, or None if:
-        - No parent found
-        - Multiple parents at the same hierarchy level exist (ambiguous)
+def find_most_specific_prepared_parent(child_dict: OMOPRecord, parent_windows) -> int64 | None:
+    """
+    The visit_occurrence_id of the most specific (shortest) parent containing the
+    child, from prepare_parent_windows() output, or None: no parent contains it, or
+    two that contain it don't contain each other, which would be ambiguous. Only the
+    child's person's parents that start no later than it are looked at. The child's
+    datetimes must be tz-naive too.
     """
-    if not potential_parents:
+    keys = _hierarchy_keys(child_dict)
+    child_start = child_dict.get(keys[0])
+    child_end = child_dict.get(keys[1])
+    if child_start is None or child_end is None:
+        return None
+    bucket = parent_windows.get((child_dict.get('person_id'), keys))
+    if bucket is None:
         return None
 
-    child_person_id = child_dict.get('person_id')
     child_visit_id = child_dict.get('visit_occurrence_id')
-
-    # Filter to parents that contain this child
-    containing_parents = []
-    for parent in potential_parents:
-        # Same person
-        if parent.get('person_id') == child_person_id:
-            # Not self
-            if parent.get('visit_occurrence_id') != child_visit_id:
-                # Temporally contains child
-                if is_temporally_contained(child_dict, parent):
-                    containing_parents.append(parent)
-
-    if not containing_parents:
+    starts, entries = bucket
+    child_index = None
+    containing = []
+    for entry in entries[:bisect_right(starts, child_start)]:
+        if entry[5].get('visit_occurrence_id') == child_visit_id:
+            child_index = entry[3]
+        elif entry[1] >= child_end:
+            containing.append(entry)
+    if child_index is not None:
+        # The child is a parent too. Of two parents read with the same keys and with the
+        # same window only the one listed first contains the other, so they can't each be
+        # nested under the other. A parent read with other keys can't contain the child back.
+        containing = [entry for entry in containing
+                      if entry[3] < child_index or entry[4] != keys
+                      or entry[0] != child_start or entry[1] != child_end]
+    return _most_specific_containing_parent(child_visit_id, containing, keys)
+
+
+def _most_specific_containing_parent(child_visit_id, containing, keys) -> int64 | None:
+    """
+    The visit_occurrence_id picked from the prepare_parent_windows() entries of the
+    parents containing a child, or None: no parents, or two that are siblings.
+    """
+    if not containing:
         return None
 
     # Check if any of the containing parents are at the same hierarchy level
     # (i.e., they don't contain each other)
-    if len(containing_parents) > 1:
-        for i in range(len(containing_parents)):
-            for j in range(i + 1, len(containing_parents)):
-                parent_i = containing_parents[i]
-                parent_j = containing_parents[j]
-
-                # Check if parent_i contains parent_j
-                i_contains_j = is_temporally_contained(parent_j, parent_i)
-
-                # Check if parent_j contains parent_i
-                j_contains_i = is_temporally_contained(parent_i, parent_j)
-
-                # If neither contains the other, they're at the same level (siblings)
-                if not i_contains_j and not j_contains_i:
-                    parent_i_id = parent_i.get('visit_occurrence_id')
-                    parent_j_id = parent_j.get('visit_occurrence_id')
-                    logger.warning(
-                        f"Visit {child_visit_id} has multiple parents at the same hierarchy level "
-                        f"(parents {parent_i_id} and {parent_j_id} don't contain each other). "
-                        f"Keeping in current level to avoid ambiguity."
-                    )
-                    return None
-
-    # All parents are in a hierarchical chain - find the most specific (shortest duration)
-    min_duration = None
-    most_specific_parent = None
-
-    for parent in containing_parents:
-        duration = get_visit_duration_days(parent)
-        if duration is not None:
-            if min_duration is None or duration < min_duration:
-                min_duration = duration
-                most_specific_parent = parent
-
-    if most_specific_parent:
-        parent_id = most_specific_parent.get('visit_occurrence_id')
-        return parent_id
-
-    return None
+    if len(containing) > 1:
+        siblings = _find_sibling_parents(containing, keys)
+        if siblings is not None:
+            logger.warning(
+                "Visit %s has multiple parents at the same hierarchy level "
+                "(parents %s and %s don't contain each other). "
+                "Keeping in current level to avoid ambiguity.",
+                child_visit_id, siblings[0][5].get('visit_occurrence_id'), siblings[1][5].get('visit_occurrence_id')
+            )
+            return None
+
+    # All parents are in a hierarchical chain - the most specific is the shortest, the first listed on a tie.
+    # A running minimum, as there are usually only one or two.
+    most_specific = None
+    for entry in containing:
+        duration = entry[2]
+        if duration is None:
+            continue
+        if (most_specific is None or duration < most_specific[2]
+                or (duration == most_specific[2] and entry[3] < most_specific[3])):
+            most_specific = entry
+    if most_specific is None:
+        return None
+    return most_specific[5].get('visit_occurrence_id')
+
+
+# Map visit_occurrence fields to visit_detail fields. Records stay plain dicts (they are
+# what every layer and the DataFrame conversion consume), so the mapping is built once
+# here rather than on each create_visit_detail_record() call.
+VISIT_TO_DETAIL_FIELDS = (
+    ('visit_occurrence_id', 'visit_detail_id'),
+    ('person_id', 'person_id'),
+    ('visit_concept_id', 'visit_detail_concept_id'),
+    ('visit_start_date', 'visit_detail_start_date'),
+    ('visit_start_datetime', 'visit_detail_start_datetime'),
+    ('visit_end_date', 'visit_detail_end_date'),
+    ('visit_end_datetime', 'visit_detail_end_datetime'),
+    ('visit_type_concept_id', 'visit_detail_type_concept_id'),
+    ('provider_id', 'provider_id'),
+    ('care_site_id', 'care_site_id'),
+    ('visit_source_value', 'visit_detail_source_value'),
+    ('visit_source_concept_id', 'visit_detail_source_concept_id'),
+    ('admitting_source_value', 'admitting_source_value'),
+    ('admitting_source_concept_id', 'admitting_source_concept_id'),
+    ('discharge_to_source_value', 'discharge_to_source_value'),
+    ('discharge_to_concept_id', 'discharge_to_concept_id'),
+    ('filename', 'filename'),
+    ('cfg_name', 'cfg_name'),
+)
 
 
-@typechecked
 def create_visit_detail_record(visit_dict: OMOPRecord,
                                top_level_parent_id: int64,
                                immediate_parent_id: int64 | None = None) -> OMOPRecord:
@@ -259,34 +342,9 @@ def create_visit_detail_record(visit_dict: OMOPRecord,
     Returns:
         Dictionary in visit_detail format
     """
-    detail_record = {}
-
-    # Map visit_occurrence fields to visit_detail fields
-    field_mapping = {
-        'visit_occurrence_id': 'visit_detail_id',
-        'person_id': 'person_id',
-        'visit_concept_id': 'visit_detail_concept_id',
-        'visit_start_date': 'visit_detail_start_date',
-        'visit_start_datetime': 'visit_detail_start_datetime',
-        'visit_end_date': 'visit_detail_end_date',
-        'visit_end_datetime': 'visit_detail_end_datetime',
-        'visit_type_concept_id': 'visit_detail_type_concept_id',
-        'provider_id': 'provider_id',
-        'care_site_id': 'care_site_id',
-        'visit_source_value': 'visit_detail_source_value',
-        'visit_source_concept_id': 'visit_detail_source_concept_id',
-        'admitting_source_value': 'admitting_source_value',
-        'admitting_source_concept_id': 'admitting_source_concept_id',
-        'discharge_to_source_value': 'discharge_to_source_value',
-        'discharge_to_concept_id': 'discharge_to_concept_id',
-        'filename': 'filename',
-        'cfg_name': 'cfg_name',
-    }
-
     # Copy mapped fields
-    for src_field, dest_field in field_mapping.items():
-        if src_field in visit_dict:
-            detail_record[dest_field] = visit_dict[src_field]
+    detail_record = {dest_field: visit_dict[src_field]
+                     for src_field, dest_field in VISIT_TO_DETAIL_FIELDS if src_field in visit_dict}
 
     # Set parent references
     detail_record['visit_occurrence_id'] = top_level_parent_id
@@ -296,7 +354,32 @@ def create_visit_detail_record(visit_dict: OMOPRecord,
     return detail_record
 
 
-@typechecked
+def find_top_level_parent(visit_id, visit_to_parent_map, top_level_cache):
+    """
+    The visit reached by following visit_to_parent_map up from visit_id, the visit
+    itself if it has no parent. top_level_cache keeps the answer for every visit on
+    the way, so chains shared by many nested visits are walked once.
+    Should the map ever loop, the walk stops when it comes back around instead of
+    going on forever.
+    """
+    chain = []
+    on_chain = set()
+    current = visit_id
+    while current in visit_to_parent_map and current not in top_level_cache:
+        if current in on_chain:
+            logger.warning("Visit %s is its own ancestor in the visit hierarchy, stopping there", current)
+            break
+        chain.append(current)
+        on_chain.add(current)
+        current = visit_to_parent_map[current]
+
+    top_level_id = top_level_cache.get(current, current)
+    for chain_id in chain:
+        top_level_cache[chain_id] = top_level_id
+    return top_level_id
+
+
+@_typechecked
 def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOPRecord] | None]) -> dict[str, list[OMOPRecord] | None]:
     """
     Main entry point for visit hierarchy processing.
@@ -333,6 +416,9 @@ def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOP
         logger.info("No visit data found to process")
         return omop_dict
 
+    # Drop tzinfo once here, so the hierarchy code compares the datetimes as they are
+    _normalize_datetimes(all_visits, VISIT_DATETIME_FIELDS)
+
     # If only one visit, no hierarchy processing needed
     if len(all_visits) == 1:
         logger.info("Only one visit found - no hierarchy processing needed")
@@ -342,26 +428,22 @@ def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOP
     logger.info(f"Total visits collected before deduplication: {len(all_visits)}")
 
     # Step 2: Deduplicate - keep 'Visit' when duplicate exists
-    # Use visit_occurrence_id as the unique key
+    # Use visit_occurrence_id as the unique key. Each config's records carry its name as
+    # cfg_name, so taking 'Visit' first and only then the encompassingEncounter visits
+    # not already seen keeps 'Visit' without comparing cfg_names; within a config the
+    # first record of an id is kept.
     visit_map = {}  # Key: visit_occurrence_id, Value: visit record
-
-    for visit in all_visits:
-        visit_id = visit.get('visit_occurrence_id')
-        if visit_id in visit_map:
-            # Duplicate found - keep 'Visit' over 'Visit_encompassingEncounter'
-            existing = visit_map[visit_id]
-            if existing.get('cfg_name') == 'Visit_encompassingEncounter' and visit.get('cfg_name') == 'Visit':
-                visit_map[visit_id] = visit  # Replace with 'Visit'
-            # Otherwise keep existing
-        else:
-            visit_map[visit_id] = visit
+    for cfg_name in ('Visit', 'Visit_encompassingEncounter'):
+        for visit in omop_dict.get(cfg_name) or ():
+            visit_map.setdefault(visit.get('visit_occurrence_id'), visit)
 
     deduplicated_visits = list(visit_map.values())
     logger.info(f"After deduplication: {len(deduplicated_visits)} unique visits (removed {len(all_visits) - len(deduplicated_visits)} duplicates)")
 
     # Step 3: Process hierarchy on deduplicated visits
     # Identify potential parent visits (inpatient with valid duration)
-    parent_visits = identify_inpatient_parents(deduplicated_visits)
+    parent_durations = {}
+    parent_visits = identify_inpatient_parents(deduplicated_visits, parent_durations)
     logger.info(f"Identified {len(parent_visits)} potential parent visits")
 
     if not parent_visits:
@@ -371,21 +453,31 @@ def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOP
             del omop_dict['Visit_encompassingEncounter']
         return omop_dict
 
-    # Build parent mapping for each visit
+    # Build parent mapping for each visit, and the final visit_occurrence from the
+    # visits left without one, in the same pass
     visit_to_parent_map = {}
     nested_visit_ids = set()
-    visit_lookup = {v.get('visit_occurrence_id'): v for v in deduplicated_visits}
+    final_visit_occurrence = []
+
+    parent_windows = prepare_parent_windows(parent_visits, parent_durations)
+    # Parents are per person: a visit of anyone with no inpatient parent stays as it is
+    parent_person_ids = {person_id for person_id, _ in parent_windows}
 
     for visit in deduplicated_visits:
+        if visit.get('person_id') not in parent_person_ids:
+            final_visit_occurrence.append(visit)
+            continue
         visit_id = visit.get('visit_occurrence_id')
 
         # Find the most specific parent for this visit
-        most_specific_parent_id = find_most_specific_parent(visit, parent_visits)
+        most_specific_parent_id = find_most_specific_prepared_parent(visit, parent_windows)
 
         if most_specific_parent_id is not None:
             visit_to_parent_map[visit_id] = most_specific_parent_id
             nested_visit_ids.add(visit_id)
-            logger.debug(f"Visit {visit_id} will be nested under parent {most_specific_parent_id}")
+            logger.debug("Visit %s will be nested under parent %s", visit_id, most_specific_parent_id)
+        else:
+            final_visit_occurrence.append(visit)
 
     logger.info(f"Found {len(nested_visit_ids)} visits to be nested")
 
@@ -397,15 +489,15 @@ def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOP
 
     # Step 5: Create visit_detail records for all nested visits
     visit_detail_list = []
+    top_level_cache = {}
     for visit_id in nested_visit_ids:
-        visit = visit_lookup.get(visit_id)
+        # visit_map is keyed by visit_occurrence_id: it is the lookup for the deduplicated visits
+        visit = visit_map.get(visit_id)
         if visit:
             immediate_parent_id = visit_to_parent_map[visit_id]
 
             # Find top-level visit_occurrence_id by traversing up hierarchy
-            top_level_parent_id = immediate_parent_id
-            while top_level_parent_id in visit_to_parent_map:
-                top_level_parent_id = visit_to_parent_map[top_level_parent_id]
+            top_level_parent_id = find_top_level_parent(immediate_parent_id, visit_to_parent_map, top_level_cache)
 
             # Determine visit_detail_parent_id
             if immediate_parent_id in nested_parent_ids:
@@ -421,8 +513,7 @@ def reclassify_nested_visit_occurrences_as_detail(omop_dict: dict[str, list[OMOP
 
     logger.info(f"Created {len(visit_detail_list)} visit_detail records")
 
-    # Step 6: Create final visit_occurrence (remove nested children, keep only top-level)
-    final_visit_occurrence = [v for v in deduplicated_visits if v.get('visit_occurrence_id') not in nested_visit_ids]
+    # Step 6: final visit_occurrence, built above: nested children removed, only top-level kept
     logger.info(f"Final visit_occurrence contains {len(final_visit_occurrence)} records")
 
     # Step 7: Update omop_dict with results
@@ -481,409 +572,529 @@ domain_dates = {
                     'id': 'device_exposure_id'},
 }
 
+# Domains whose events get visit_occurrence_id and visit_detail_id from visit reconciliation
+RECONCILED_DOMAINS = frozenset({'Measurement', 'Observation', 'Condition', 'Procedure', 'Drug', 'Device'})
+
+
+@cache
+def get_reconciled_configs() -> tuple[tuple[str, str], ...]:
+    """ (domain, config_name) for every config feeding RECONCILED_DOMAINS, from the ddl.py
+        mappings, built on first use. Both the visit_occurrence and the visit_detail passes
+        walk this same tuple.
+    """
+    return tuple(
+        (domain_name, cfg_name) for cfg_name, domain_name in DDL.get_config_to_domain_name_dict().items()
+        if domain_name in RECONCILED_DOMAINS
+    )
+
 
-@typechecked
 def strip_tz(dt): # Strip timezone
-    if isinstance(dt, datetime.datetime) and dt.tzinfo is not None:
+    # naive datetimes, dates and None, the usual case, come back as they are at one attribute read
+    if getattr(dt, 'tzinfo', None) is None:
+        return dt
+    if isinstance(dt, datetime.datetime):
         return dt.replace(tzinfo=None)
     return dt
 
 
-@typechecked
-def reconcile_visit_FK_with_specific_domain(domain: str, 
-                                            domain_dict: list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date] ] | None , 
-                                            visit_dict:  list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date] ] | None):
-    if visit_dict is None:
-        logger.warning(f"no visits for {domain} in reconcile_visit_FK_with_specific_domain, reconcilliation")
-        return
+VISIT_WINDOW_FIELDS = ('visit_start_date', 'visit_start_datetime', 'visit_end_date', 'visit_end_datetime')
+VISIT_DATETIME_FIELDS = ('visit_start_datetime', 'visit_end_datetime')
+VISIT_DETAIL_DATETIME_FIELDS = ('visit_detail_start_datetime', 'visit_detail_end_datetime')
 
-    if domain_dict is None:
-        logger.warning(f"no data for {domain} in reconcile_visit_FK_with_specific_domain, reconcilliation")
-        return
 
-    # Only Measurement, Observation, Condition, Procedure, Drug, and Device participate in Visit FK reconciliation
-    if domain not in domain_dates:
-        logger.warning(f"no metadata for domain {domain} in reconcile_visit_FK_with_specific_domain, reconcilliation")
-        return
+def _normalize_datetimes(records, fields):
+    """ Drops tzinfo from the given datetime fields in place, once per call, so the
+        matching loops compare visit datetimes as they are instead of calling
+        strip_tz() per event. Output loses nothing: the parser reads datetimes
+        with ignoretz, and layer_datasets strips tzinfo from datetime columns.
+    """
+    for record in records:
+        for field in fields:
+            value = record.get(field)
+            if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+                record[field] = value.replace(tzinfo=None)
 
-    if 'date' in domain_dates[domain].keys():
-        # Logic for domains with just one date
-        for thing in domain_dict:
-
-            date_field_name = domain_dates[domain]['date'][0]
-            datetime_field_name = domain_dates[domain]['date'][1]
-
-            # Start with the plain date. If a datetime value is present, prefer it (more specific)
-            date_field_value = thing[date_field_name]
-            if datetime_field_name in thing and (thing[datetime_field_name] is not None and isinstance(thing[datetime_field_name], datetime.datetime)):
-                date_field_value = strip_tz(thing[datetime_field_name])
-
-            if date_field_value is not None:
-                matches = []
-
-                for visit in visit_dict:
-                    try:
-                        start_visit_date = visit['visit_start_date']
-                        start_visit_datetime = strip_tz(visit['visit_start_datetime'])
-                        end_visit_date = visit['visit_end_date']
-                        end_visit_datetime = strip_tz(visit['visit_end_datetime'])
-
-                        in_window = False
-                        # Match using datetime
-                        if isinstance(date_field_value, datetime.datetime):
-                            if start_visit_datetime != end_visit_datetime:
-                                in_window = start_visit_datetime <= date_field_value <= end_visit_datetime
-                            else:
-                                end_visit_datetime_adjusted = datetime.datetime.combine(end_visit_date,
-                                                                                        datetime.time(23, 59, 59))
-                                in_window = start_visit_datetime <= date_field_value <= end_visit_datetime_adjusted
-
-                        # Match using only dates
-                        elif isinstance(date_field_value, datetime.date):
-                            in_window = start_visit_date <= date_field_value <= end_visit_date
-
-                        if in_window:
-                            matches.append(visit['visit_occurrence_id'])
-
-                    except KeyError as ke:
-                        logger.warning(f"missing field  \"{ke}\", in visit reconcilliation, got error {type(ke)} ")
-                    except Exception as e:
-                        pass
-
-                if len(matches) == 1:
-                    thing['visit_occurrence_id'] = matches[0]
-                elif len(matches) == 0:
-                    logger.warning(f" couldn't reconcile visit for {domain} event: {thing}")
-                else:
-                    logger.warning(
-                        "Ambiguous visit match for %s (id=%s): %d candidates; leaving visit_occurrence_id unset",
-                        domain, thing.get(domain_dates[domain]['id']), len(matches)
-                    )
-                    thing['__visit_candidates'] = matches
 
+def warn_incomplete_visits(visit_dict):
+    """ Reports, once per document, visits missing any of the VISIT_WINDOW_FIELDS.
+        The matching loops skip such a visit for the comparisons it can't take part in.
+    """
+    for visit in visit_dict:
+        missing = [field for field in VISIT_WINDOW_FIELDS if visit.get(field) is None]
+        if missing:
+            logger.warning("visit %s is missing %s, in visit reconcilliation",
+                           visit.get('visit_occurrence_id'), missing)
+
+
+def _single_date_windows_fn(date_field_name, datetime_field_name):
+    def get_windows(things):
+        windows = []
+        append = windows.append
+        datetime_type = datetime.datetime
+        for thing in things:
+            value = thing.get(datetime_field_name)
+            if isinstance(value, datetime_type):
+                if value.tzinfo is not None:
+                    value = value.replace(tzinfo=None)
             else:
-                # S.O.L.
-                logger.warning(f"no date available for visit reconcilliation in domain {domain} for {thing}")
-
-    # Logic for domains with start and end date/dateime
-    elif 'start' in domain_dates[domain].keys() and 'end' in domain_dates[domain].keys():
-        for thing in domain_dict:
-            start_date_field_name = domain_dates[domain]['start'][0]
-            start_datetime_field_name = domain_dates[domain]['start'][1]
-            end_date_field_name = domain_dates[domain]['end'][0]
-            end_datetime_field_name = domain_dates[domain]['end'][1]
-
-            start_date_value = None
-            end_date_value = None
-
-            # Prefer datetime if available
-            if thing[start_datetime_field_name] is not None and isinstance(thing[start_datetime_field_name],
-                                                                           datetime.datetime):
-                start_date_value = strip_tz(thing[start_datetime_field_name])
-            else:
-                start_date_value = thing[start_date_field_name]
-
-            # Prefer datetime if available, else use end_date field, else fallback to start_date
-            if thing[end_datetime_field_name] is not None and isinstance(thing[end_datetime_field_name],
-                                                                         datetime.datetime):
-                end_date_value = strip_tz(thing[end_datetime_field_name])
-            elif thing[end_date_field_name] is not None:
-                end_date_value = thing[end_date_field_name]
+                value = thing.get(date_field_name)
+                if isinstance(value, datetime_type) and value.tzinfo is not None:
+                    value = value.replace(tzinfo=None)
+            append((value, value))
+        return windows
+    return get_windows
+
+
+def _start_end_windows_fn(start_date_field_name, start_datetime_field_name,
+                          end_date_field_name, end_datetime_field_name):
+    def get_windows(things):
+        windows = []
+        append = windows.append
+        datetime_type = datetime.datetime
+        for thing in things:
+            start_value = thing.get(start_datetime_field_name)
+            if isinstance(start_value, datetime_type):
+                if start_value.tzinfo is not None:
+                    start_value = start_value.replace(tzinfo=None)
             else:
-                end_date_value = start_date_value
-
-            if start_date_value is not None and end_date_value is not None:
-                matches = []
-
-                for visit in visit_dict:
-                    try:
-                        start_visit_date = visit['visit_start_date']
-                        start_visit_datetime = strip_tz(visit['visit_start_datetime'])
-                        end_visit_date = visit['visit_end_date']
-                        end_visit_datetime = strip_tz(visit['visit_end_datetime'])
-
-                        in_window = False
-                        # Adjust datetime comparisons for start and end values
-                        if isinstance(start_date_value, datetime.datetime) and isinstance(end_date_value,
-                                                                                          datetime.datetime):
-                            if start_visit_datetime != end_visit_datetime:
-                                in_window = (
-                                        (start_visit_datetime <= start_date_value <= end_visit_datetime) and
-                                        (start_visit_datetime <= end_date_value <= end_visit_datetime)
-                                )
-                            else:
-                                end_visit_datetime_adjusted = datetime.datetime.combine(end_visit_date,
-                                                                                        datetime.time(23, 59, 59))
-                                in_window = (
-                                        (start_visit_datetime <= start_date_value <= end_visit_datetime_adjusted) and
-                                        (start_visit_datetime <= end_date_value <= end_visit_datetime_adjusted)
-                                )
-                        # Compare with dates if datetime is not available
-                        elif isinstance(start_date_value, datetime.date) and isinstance(end_date_value, datetime.date):
-                            in_window = (
-                                    (start_visit_date <= start_date_value <= end_visit_date) and
-                                    (start_visit_date <= end_date_value <= end_visit_date)
-                            )
-
-                        if in_window:
-                            matches.append(visit['visit_occurrence_id'])
-
-                    except KeyError as ke:
-                        print(f"WARNING missing field  \"{ke}\", in visit reconcilliation, got error {type(ke)} ")
-                    except Exception as e:
-                        print(f"WARNING something wrong in visit reconciliation: {e}")
-
-                if len(matches) == 1:
-                    thing['visit_occurrence_id'] = matches[0]
-                elif len(matches) == 0:
-                    logger.warning(f" couldn't reconcile visit for {domain} event: {thing}")
-                else:
-                    logger.warning(
-                        "Ambiguous visit match for %s (id=%s): %d candidates; leaving visit_occurrence_id unset",
-                        domain, thing.get(domain_dates[domain]['id']), len(matches)
-                    )
-                    thing['__visit_candidates'] = matches
+                start_value = thing.get(start_date_field_name)
 
+            end_value = thing.get(end_datetime_field_name)
+            if isinstance(end_value, datetime_type):
+                if end_value.tzinfo is not None:
+                    end_value = end_value.replace(tzinfo=None)
             else:
-                # S.O.L.
-                print(f"ERROR no date available for visit reconcilliation in domain {domain} (detail in logs)")
-                logger.warning(f" no date available for visit reconcilliation in domain {domain} for {thing}")
+                end_date_value = thing.get(end_date_field_name)
+                end_value = start_value if end_date_value is None else end_date_value
 
-    else:
-        logger.info("??? bust in domain_dates for reconcilliation")
+            append((start_value, end_value))
+        return windows
+    return get_windows
 
 
-@typechecked
-def assign_visit_occurrence_ids_to_events(data_dict: dict[str,
-                                                             list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date] | None] | None]):
-    # data_dict is a dictionary of config_names to a list of record-dicts
-    # Only Measurement, Observation, Condition, Procedure, Drug, and Device participate in Visit FK reconciliation
-    # Visit hierarchy processing (reclassify_nested_visit_occurrences_as_detail) merges both
-    # Visit and Visit_encompassingEncounter configs, so by this point all visits (visit_occurrence) are in 'Visit'.
-    VISIT_CFG_NAME = 'Visit'
+def make_event_windows_fn(date_fields):
+    """
+    A function returning (start, end) for each of a list of events, for one domain's
+    date_fields, with its field names bound. Datetimes (tz stripped) are preferred over
+    dates, and single-date domains give the same value twice. A missing end falls back
+    to the end date, then to the start. Either may be None.
+    """
+    if 'date' in date_fields:
+        return _single_date_windows_fn(*date_fields['date'])
+    return _start_end_windows_fn(*date_fields['start'], *date_fields['end'])
+
 
-    # Use ddl.py mappings as single source of truth
-    config_to_domain_map = DDL.config_to_domain_name_dict
+@cache
+def get_event_windows_fn(domain):
+    """ make_event_windows_fn() of domain_dates[domain], made once per domain. """
+    return make_event_windows_fn(domain_dates[domain])
 
-    # Only process configs that exist in data_dict and have clinical events needing visit reconciliation
-    for cfg_name, domain_name in config_to_domain_map.items():
-        if cfg_name in data_dict and data_dict[cfg_name]:
-            if domain_name in ['Measurement', 'Observation', 'Condition', 'Procedure', 'Drug', 'Device']:
-                if VISIT_CFG_NAME in data_dict:
-                    reconcile_visit_FK_with_specific_domain(domain_name, data_dict[cfg_name], data_dict[VISIT_CFG_NAME])
-                else:
-                    print(f"NO \"{VISIT_CFG_NAME}\", no visit reconciliation or inference done.")
 
-    for cfg_name, domain_name in config_to_domain_map.items():
-        if cfg_name in data_dict and data_dict[cfg_name]:
-            if domain_name in ['Measurement', 'Observation', 'Condition', 'Procedure', 'Drug', 'Device']:
-                for record in data_dict[cfg_name]:
-                    if '__visit_candidates' in record:
-                        del record['__visit_candidates']
+_EPOCH = datetime.datetime(1970, 1, 1)
+_ONE_MICROSECOND = datetime.timedelta(microseconds=1)
 
 
-@typechecked
-def assign_visit_detail_ids_to_events(data_dict: dict[str,
-                                                         list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date] | None] | None]):
+def _datetimes_to_ints(values):
+    """ Microseconds since 1970-01-01 of naive datetimes, as an int64 array. Unlike
+        timestamp(), this doesn't consult the local timezone, so order is kept exactly.
+        Plain arithmetic here beats numpy parsing datetime objects into datetime64.
     """
-    visit_detail FK reconciliation: Match clinical domain events to visit_detail records.
+    return np.fromiter(((value - _EPOCH) // _ONE_MICROSECOND for value in values),
+                       dtype=np.int64, count=len(values))
 
-    This assigns visit_detail_id to events that occur during nested visits.
-    Events must already have visit_occurrence_id set (from assign_visit_occurrence_ids_to_events).
 
-    For events that fall within multiple nested visits, chooses the most specific
-    (smallest duration) visit_detail.
+def _dates_to_ints(values):
+    """ Ordinals of dates, as an int64 array. """
+    return np.fromiter((value.toordinal() for value in values), dtype=np.int64, count=len(values))
 
-    Args:
-        data_dict: Dictionary with config_name → list of records (omop_dict)
-    """
-    VISIT_DETAIL_CFG_NAME = 'VISITDETAIL_visit_occurrence'
 
-    if VISIT_DETAIL_CFG_NAME not in data_dict or not data_dict[VISIT_DETAIL_CFG_NAME]:
-        logger.info("No visit_detail records found - skipping visit_detail FK reconciliation")
-        return
+# (event, candidate visit) pairs compared per array operation, bounding the
+# candidate arrays whatever the number of events or how much visits overlap
+MATCH_CANDIDATE_LIMIT = 1 << 16
 
-    visit_detail_list = data_dict[VISIT_DETAIL_CFG_NAME]
-    logger.info(f"Processing visit_detail FK reconciliation for {len(visit_detail_list)} visit_detail records")
 
-    # Use ddl.py mappings as single source of truth
-    config_to_domain_map = DDL.config_to_domain_name_dict
+def _window_arrays(starts, ends, visit_ids, to_ints):
+    """ (starts, ends, latest_ends, positions, ids) for _ids_in_windows(): the windows sorted
+        by start, the running latest end, their list positions, and the ids in list order.
+    """
+    starts = to_ints(starts)
+    ends = to_ints(ends)
+    positions = np.argsort(starts, kind='stable')
+    ids = np.empty(len(visit_ids), dtype=object)
+    ids[:] = visit_ids
+    return starts[positions], ends[positions], np.maximum.accumulate(ends[positions]), positions, ids
+
 
-    # Only process configs that exist and have clinical events needing visit_detail reconciliation
-    for cfg_name, domain_name in config_to_domain_map.items():
-        if cfg_name in data_dict and data_dict[cfg_name]:
-            if domain_name in ['Measurement', 'Observation', 'Condition', 'Procedure', 'Drug', 'Device']:
-                reconcile_visit_detail_FK_with_specific_domain(domain_name, data_dict[cfg_name], visit_detail_list)
+def prepare_visit_windows(visit_dict):
+    """
+    Flattens visits, once per document, into what _ids_in_windows() matches against:
+    ((datetime_windows, _datetimes_to_ints), (date_windows, _dates_to_ints)). The
+    windows are _window_arrays(), the bounds int64 arrays from that converter, so
+    events are matched by comparing ints. Datetimes must already be tz-naive. A visit
+    whose start and end datetimes are equal is taken to run to 23:59:59 on its end
+    date. A visit missing the fields for one kind of window is left out of it. Each
+    kind is collected as columns, (starts, ends, ids), rather than a tuple per visit.
+    """
+    datetime_columns = ([], [], [])
+    date_columns = ([], [], [])
+    for visit in visit_dict:
+        visit_id = visit.get('visit_occurrence_id')
+        start_visit = visit.get('visit_start_datetime')
+        end_visit = visit.get('visit_end_datetime')
+        end_visit_date = visit.get('visit_end_date')
+        if start_visit is not None and end_visit is not None:
+            if start_visit == end_visit:
+                end_visit = None
+                if end_visit_date is not None:
+                    end_visit = datetime.datetime.combine(end_visit_date, datetime.time(23, 59, 59))
+            if end_visit is not None:
+                datetime_columns[0].append(start_visit)
+                datetime_columns[1].append(end_visit)
+                datetime_columns[2].append(visit_id)
+        start_visit_date = visit.get('visit_start_date')
+        if start_visit_date is not None and end_visit_date is not None:
+            date_columns[0].append(start_visit_date)
+            date_columns[1].append(end_visit_date)
+            date_columns[2].append(visit_id)
+    return ((_window_arrays(*datetime_columns, _datetimes_to_ints), _datetimes_to_ints),
+            (_window_arrays(*date_columns, _dates_to_ints), _dates_to_ints))
+
+
+def _held_windows(starts, ends, windows):
+    """
+    The matching kernel, for a batch of events at once: which windows hold both the
+    start and end of each event, for int arrays starts and ends. A window holds both
+    when it starts by the earlier and ends no sooner than the later. With windows
+    sorted by start, those starting by the earlier are a prefix, and the running latest
+    end rules out the front of it, leaving each event a range of candidates; only those
+    are compared, in blocks of events holding at most MATCH_CANDIDATE_LIMIT of them, so
+    no array grows with events times visits. Yields, per block, (offset, event_indexes,
+    window_indexes): the held pairs, events counted from offset and windows by their
+    places in the lists.
+    """
+    visit_starts, visit_ends, latest_ends, positions, visit_ids = windows
+    earliest = np.minimum(starts, ends)
+    latest = np.maximum(starts, ends)
+    stop = np.searchsorted(visit_starts, earliest, side='right')
+    first = np.searchsorted(latest_ends, latest, side='left')
+    counts = np.maximum(stop - first, 0)
+    counted = np.cumsum(counts)
+    offset = 0
+    while offset < len(starts):
+        # as many events as fit MATCH_CANDIDATE_LIMIT candidates, at least one
+        before = int(counted[offset - 1]) if offset else 0
+        block_end = max(int(np.searchsorted(counted, before + MATCH_CANDIDATE_LIMIT, side='right')), offset + 1)
+        block_counts = counts[offset:block_end]
+        block_first = first[offset:block_end]
+        block_latest = latest[offset:block_end]
+        total = int(counted[block_end - 1]) - before
+        block_offset = offset
+        offset = block_end
+        if total == 0:
+            continue
+
+        # every (event, candidate) pair, flattened
+        event_indexes = np.repeat(np.arange(len(block_counts)), block_counts)
+        candidates = (np.repeat(block_first, block_counts)
+                      + (np.arange(total) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)))
+        holds = visit_ends[candidates] >= block_latest[event_indexes]
+        yield block_offset, event_indexes[holds], positions[candidates[holds]]
+
+
+def _ids_in_windows(starts, ends, windows):
+    """ For each (start, end) in the int arrays starts and ends, the ids of the windows holding both, in window order. """
+    visit_ids = windows[-1]
+    matches = [[] for _ in range(len(starts))]
+    for block_offset, event_indexes, window_indexes in _held_windows(starts, ends, windows):
+        # back to window order within each event
+        in_order = np.lexsort((window_indexes, event_indexes))
+        for event_index, visit_id in zip(event_indexes[in_order].tolist(), visit_ids[window_indexes[in_order]].tolist()):
+            matches[block_offset + event_index].append(visit_id)
+    return matches
+
+
+def _shortest_in_windows(starts, ends, windows, durations):
+    """
+    For each (start, end) in the int arrays starts and ends, the id of the window
+    holding both with the least of durations, the first in window order on a tie,
+    or None.
+    """
+    visit_ids = windows[-1]
+    # windows ranked once, shortest first and then in window order, so each event
+    # takes its least ranked pair without sorting the pairs
+    by_rank = np.lexsort((np.arange(len(durations)), durations))
+    ranks = np.empty_like(by_rank)
+    ranks[by_rank] = np.arange(len(by_rank))
+    shortest = [None] * len(starts)
+    for block_offset, event_indexes, window_indexes in _held_windows(starts, ends, windows):
+        if len(event_indexes) == 0:
+            continue
+        # the pairs come grouped by event, in event order
+        firsts = np.flatnonzero(np.diff(event_indexes, prepend=-1))
+        best = by_rank[np.minimum.reduceat(ranks[window_indexes], firsts)]
+        for event_index, visit_id in zip(event_indexes[firsts].tolist(), visit_ids[best].tolist()):
+            shortest[block_offset + event_index] = visit_id
+    return shortest
+
+
+def _events_by_kind(event_windows):
+    """
+    Indexes of the events of event_windows to match against each kind of window, 0
+    datetime and 1 date. An event with a datetime paired with a plain date can't be
+    ordered against either kind and is left out, as is one with a value of any other
+    type. The types and appends are looked up once rather than per event.
+    """
+    by_kind = ([], [])
+    datetime_type, date_type = datetime.datetime, datetime.date
+    append_datetime, append_date = by_kind[0].append, by_kind[1].append
+    for i, (start, end) in enumerate(event_windows):
+        if isinstance(start, datetime_type):
+            if isinstance(end, datetime_type):
+                append_datetime(i)
+        elif isinstance(start, date_type) and isinstance(end, date_type) and not isinstance(end, datetime_type):
+            append_date(i)
+    return by_kind
+
+
+def flatten_event_windows(event_windows):
+    """
+    event_windows as the batch matchers take them: for each kind of window, 0 datetime
+    and 1 date, (indexes, starts, ends), the events' places in event_windows and their
+    bounds as int64 arrays. Worked out once, it serves both visit_occurrence and
+    visit_detail matching, so each event's bounds are converted only once.
+    """
+    return tuple((indexes,
+                  to_ints([event_windows[i][0] for i in indexes]),
+                  to_ints([event_windows[i][1] for i in indexes]))
+                 for indexes, to_ints in zip(_events_by_kind(event_windows), (_datetimes_to_ints, _dates_to_ints)))
 
 
-@typechecked
-def reconcile_visit_detail_FK_with_specific_domain(domain: str,
-                                                    domain_dict: list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date]] | None,
-                                                    visit_detail_dict: list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date]] | None):
+def match_prepared_visit_occurrences_batch(event_windows, visit_windows, flat_events=None):
+    """
+    The visit_occurrence_ids of the visits holding each (start, end) of event_windows,
+    against prepare_visit_windows() output: datetimes compared with visit datetimes,
+    plain dates with visit dates. Returns a list of matches lists in the same order,
+    with None for an event missing either value. flat_events is
+    flatten_event_windows() of event_windows, when the caller has it.
+    """
+    if flat_events is None:
+        flat_events = flatten_event_windows(event_windows)
+    all_matches = [None if start is None or end is None else [] for start, end in event_windows]
+    for (windows, to_ints), (indexes, starts, ends) in zip(visit_windows, flat_events):
+        if not indexes or len(windows[-1]) == 0:
+            continue
+        for i, matches in zip(indexes, _ids_in_windows(starts, ends, windows)):
+            all_matches[i] = matches
+    return all_matches
+
+
+def prepare_visit_detail_windows(visit_detail_list):
+    """ (groups, (datetime_columns, _datetimes_to_ints), (date_columns, _dates_to_ints)) for
+        match_most_specific_prepared_visit_details_batch(); datetimes must be tz-naive.
+    """
+    groups = {}
+    # (groups, starts, ends, visit_details, durations) lists of each kind, 0 datetime and 1 date
+    columns_by_kind = (([], [], [], [], []), ([], [], [], [], []))
+    for vd in visit_detail_list:
+        bounds = ((vd.get('visit_detail_start_datetime'), vd.get('visit_detail_end_datetime')),
+                  (vd.get('visit_detail_start_date'), vd.get('visit_detail_end_date')))
+        group = duration = None
+        for (vd_start, vd_end), columns in zip(bounds, columns_by_kind):
+            if vd_start and vd_end:
+                if group is None:
+                    group = groups.setdefault(vd.get('visit_occurrence_id'), len(groups))
+                    duration = _visit_detail_duration_days(*bounds[0], *bounds[1])
+                columns[0].append(group)
+                columns[1].append(vd_start)
+                columns[2].append(vd_end)
+                columns[3].append(vd)
+                columns[4].append(duration)
+
+    prepared = [groups]
+    for columns, to_ints in zip(columns_by_kind, (_datetimes_to_ints, _dates_to_ints)):
+        visit_details = np.empty(len(columns[3]), dtype=object)
+        visit_details[:] = columns[3]
+        prepared.append(((np.array(columns[0], dtype=np.int64), to_ints(columns[1]), to_ints(columns[2]),
+                          visit_details, np.array(columns[4], dtype=np.float64)), to_ints))
+    return tuple(prepared)
+
+
+def _shortest_in_grouped_windows(event_groups, starts, ends, columns):
     """
-    Match events to visit_detail records by temporal containment.
-    Choose the most specific (smallest duration) matching visit_detail.
+    _shortest_in_windows() where an event is only held by the windows of its own
+    group, for all groups in one sweep. The bounds are replaced by their ranks among
+    all values, which keeps their order and ties, and each group's ranks are moved to
+    a stretch of their own, so no window reaches into another group's events.
+    """
+    window_groups, window_starts, window_ends, visit_details, durations = columns
+    values, ranks = np.unique(np.concatenate((window_starts, window_ends, starts, ends)), return_inverse=True)
+    window_count = len(window_starts)
+    stretch = len(values)
+    window_starts = window_groups * stretch + ranks[:window_count]
+    window_ends = window_groups * stretch + ranks[window_count:2 * window_count]
+    event_count = len(starts)
+    starts = event_groups * stretch + ranks[2 * window_count:2 * window_count + event_count]
+    ends = event_groups * stretch + ranks[2 * window_count + event_count:]
+    windows = _window_arrays(window_starts, window_ends, visit_details, np.asarray)
+    return _shortest_in_windows(starts, ends, windows, durations)
+
+
+def match_most_specific_prepared_visit_details_batch(event_windows, visit_occurrence_ids, detail_windows,
+                                                     flat_events=None):
+    """
+    For each (start, end) of event_windows, the shortest visit_detail holding it, the
+    first listed on a tie, among the visit_details of the matching one of
+    visit_occurrence_ids, from prepare_visit_detail_windows() output. Datetimes are
+    compared with datetimes and dates with dates. Returns a list in the same order, with
+    None for an event that matches nothing, has no visit_occurrence_id or is missing a date.
+    flat_events is flatten_event_windows() of event_windows, when the caller has it.
+    """
+    groups = detail_windows[0]
+    # each event's group, looked up once; None for no visit_occurrence_id or no visit_details
+    event_groups = [None if voc_id is None else groups.get(voc_id) for voc_id in visit_occurrence_ids]
+    most_specific = [None] * len(event_windows)
+    if event_groups.count(None) == len(event_groups):
+        # none of the events' visit_occurrences has visit_details
+        return most_specific
+    # the caller's flat_events may hold events with no group, to be left out
+    all_grouped = flat_events is None
+    if all_grouped:
+        # only the events with visit_details to match are converted
+        flat_events = flatten_event_windows([(None, None) if group is None else window
+                                             for window, group in zip(event_windows, event_groups)])
+    for (columns, to_ints), (indexes, starts, ends) in zip(detail_windows[1:], flat_events):
+        if not all_grouped:
+            kept = [k for k, i in enumerate(indexes) if event_groups[i] is not None]
+            indexes = [indexes[k] for k in kept]
+            starts = starts[kept]
+            ends = ends[kept]
+        if not indexes or len(columns[0]) == 0:
+            continue
+        kind_groups = np.fromiter((event_groups[i] for i in indexes), dtype=np.int64, count=len(indexes))
+        for i, vd in zip(indexes, _shortest_in_grouped_windows(kind_groups, starts, ends, columns)):
+            most_specific[i] = vd
+    return most_specific
+
+
+def _set_visit_detail_ids(domain_dict, event_windows, visit_occurrence_ids, detail_windows, flat_events=None):
+    """
+    Sets visit_detail_id on each event that one of its visit_occurrence's visit_details
+    holds, from prepare_visit_detail_windows() output. Returns how many were set.
+    """
+    matched_count = 0
+    for thing, most_specific in zip(domain_dict, match_most_specific_prepared_visit_details_batch(
+            event_windows, visit_occurrence_ids, detail_windows, flat_events)):
+        if most_specific is not None:
+            thing['visit_detail_id'] = most_specific['visit_detail_id']
+            matched_count += 1
+    return matched_count
 
-    Args:
-        domain: Domain name (e.g., 'Measurement', 'Condition')
-        domain_dict: List of event records to reconcile
-        visit_detail_dict: List of visit_detail records
+
+def _set_visit_occurrence_id(domain, id_field_name, thing, matches):
     """
-    if not visit_detail_dict or not domain_dict:
-        return
+    Sets visit_occurrence_id on an event from the ids of the visits holding it when
+    there is exactly one, and warns otherwise.
+    """
+    if len(matches) == 1:
+        thing['visit_occurrence_id'] = matches[0]
+    elif len(matches) == 0:
+        logger.warning(" couldn't reconcile visit for %s event: %s", domain, thing)
+    else:
+        logger.warning(
+            "Ambiguous visit match for %s (id=%s): %d candidates; leaving visit_occurrence_id unset",
+            domain, thing.get(id_field_name), len(matches)
+        )
 
-    if domain not in domain_dates:
-        logger.debug(f"No date metadata for domain {domain} in visit_detail reconciliation")
-        return
 
-    logger.info(f"Reconciling visit_detail FKs for {domain} ({len(domain_dict)} events, {len(visit_detail_dict)} visit_details)")
+def reconcile_visit_FK_with_specific_domain(domain: str, domain_dict, visit_dict):
+    """ Sets visit_occurrence_id alone on the events of one config against visit_dict,
+        the way assign_visit_ids_to_events() does without visit_detail.
+    """
+    if visit_dict is None or domain_dict is None or domain not in domain_dates:
+        logger.warning("no visits, data or metadata for %s in visit reconcilliation", domain)
+        return
+    _normalize_datetimes(visit_dict, VISIT_DATETIME_FIELDS)
+    reconcile_visit_FKs_with_specific_domain(domain, domain_dict, prepare_visit_windows(visit_dict), None)
 
-    # Visit_detail date field mapping
-    visit_detail_date_fields = {
-        'start_date': 'visit_detail_start_date',
-        'start_datetime': 'visit_detail_start_datetime',
-        'end_date': 'visit_detail_end_date',
-        'end_datetime': 'visit_detail_end_datetime',
-    }
 
-    matched_count = 0
-    no_match_count = 0
-
-    # Process events with a single date field
-    if 'date' in domain_dates[domain].keys():
-        for thing in domain_dict:
-            # Skip if no visit_occurrence_id
-            if 'visit_occurrence_id' not in thing or thing['visit_occurrence_id'] is None:
-                continue
-
-            date_field_name = domain_dates[domain]['date'][0]
-            datetime_field_name = domain_dates[domain]['date'][1]
-
-            # Get event date (prefer datetime over date)
-            event_date = None
-            if thing[datetime_field_name] is not None and isinstance(thing[datetime_field_name], datetime.datetime):
-                event_date = strip_tz(thing[datetime_field_name])
-            else:
-                event_date = thing[date_field_name]
-
-            if event_date is None:
-                continue
-
-            # Find matching visit_details
-            matches = []
-            for vd in visit_detail_dict:
-                # Must be in the same visit_occurrence
-                if vd.get('visit_occurrence_id') != thing.get('visit_occurrence_id'):
-                    continue
-
-                # Get visit_detail dates
-                vd_start_datetime = strip_tz(vd.get(visit_detail_date_fields['start_datetime']))
-                vd_start_date = vd.get(visit_detail_date_fields['start_date'])
-                vd_end_datetime = strip_tz(vd.get(visit_detail_date_fields['end_datetime']))
-                vd_end_date = vd.get(visit_detail_date_fields['end_date'])
-
-                # Check containment
-                in_window = False
-                if isinstance(event_date, datetime.datetime):
-                    if vd_start_datetime and vd_end_datetime:
-                        in_window = vd_start_datetime <= event_date <= vd_end_datetime
-                elif isinstance(event_date, datetime.date):
-                    if vd_start_date and vd_end_date:
-                        in_window = vd_start_date <= event_date <= vd_end_date
-
-                if in_window:
-                    matches.append(vd)
-
-            # Set visit_detail_id based on matches
-            if len(matches) == 1:
-                thing['visit_detail_id'] = matches[0]['visit_detail_id']
-                matched_count += 1
-            elif len(matches) > 1:
-                # Multiple matches - choose most specific (smallest duration)
-                most_specific = min(matches, key=lambda vd: get_visit_detail_duration(vd))
-                thing['visit_detail_id'] = most_specific['visit_detail_id']
-                matched_count += 1
-                logger.debug(f"{domain} event matched {len(matches)} visit_details, chose most specific (id={most_specific['visit_detail_id']})")
-            else:
-                # No match - leave visit_detail_id as None
-                no_match_count += 1
-
-    # Process events with start and end dates
-    elif 'start' in domain_dates[domain].keys() and 'end' in domain_dates[domain].keys():
-        for thing in domain_dict:
-            # Skip if no visit_occurrence_id
-            if 'visit_occurrence_id' not in thing or thing['visit_occurrence_id'] is None:
-                continue
-
-            start_date_field = domain_dates[domain]['start'][0]
-            start_datetime_field = domain_dates[domain]['start'][1]
-            end_date_field = domain_dates[domain]['end'][0]
-            end_datetime_field = domain_dates[domain]['end'][1]
-
-            # Get event dates
-            start_date_value = None
-            end_date_value = None
-
-            if thing[start_datetime_field] is not None and isinstance(thing[start_datetime_field], datetime.datetime):
-                start_date_value = strip_tz(thing[start_datetime_field])
-            else:
-                start_date_value = thing[start_date_field]
+@_typechecked
+def reconcile_visit_FKs_with_specific_domain(domain: str,
+                                             domain_dict: list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date]],
+                                             visit_windows: tuple | None,
+                                             visit_detail_windows: tuple | None):
+    """
+    Sets visit_occurrence_id and then visit_detail_id on each event of one config,
+    working out the event's dates once for both. visit_windows comes from
+    prepare_visit_windows(), None when there are no visits.
+
+    visit_occurrence_id is set when exactly one visit contains the event; an existing
+    value is kept otherwise. visit_detail_id is then taken from the visit_details of
+    that visit_occurrence_id, from visit_detail_windows (prepare_visit_detail_windows()),
+    None when visit_detail_id isn't to be set.
+    """
+    id_field_name = domain_dates[domain]['id']
+
+    event_windows = get_event_windows_fn(domain)(domain_dict)
+    # the events' bounds as ints, for both matchers
+    flat_events = flatten_event_windows(event_windows)
+    all_matches = [None] * len(domain_dict)
+    if visit_windows is not None:
+        all_matches = match_prepared_visit_occurrences_batch(event_windows, visit_windows, flat_events)
+
+    for thing, (start, end), matches in zip(domain_dict, event_windows, all_matches):
+        if start is None or end is None:
+            logger.warning("no date available for visit reconcilliation in domain %s for %s", domain, thing)
+            continue
+
+        if matches is not None:
+            _set_visit_occurrence_id(domain, id_field_name, thing, matches)
+
+    if visit_detail_windows is not None:
+        visit_occurrence_ids = [thing.get('visit_occurrence_id') for thing in domain_dict]
+        matched_count = _set_visit_detail_ids(domain_dict, event_windows, visit_occurrence_ids, visit_detail_windows,
+                                              flat_events)
+        logger.info("%s: %d events matched to visit_detail", domain, matched_count)
+
+
+@_typechecked
+def assign_visit_ids_to_events(data_dict: dict[str,
+                                               list[dict[str, None | str | float | int | int64 | datetime.datetime | datetime.date] | None] | None],
+                               do_visit_detail: bool = True):
+    """
+    Visit FK reconciliation in a single pass over each config's events: visit_occurrence_id
+    from the visits in 'Visit', then, if do_visit_detail, visit_detail_id from the
+    visit_details of that visit_occurrence.
 
-            if thing[end_datetime_field] is not None and isinstance(thing[end_datetime_field], datetime.datetime):
-                end_date_value = strip_tz(thing[end_datetime_field])
-            elif thing[end_date_field] is not None:
-                end_date_value = thing[end_date_field]
-            else:
-                end_date_value = start_date_value
-
-            if start_date_value is None or end_date_value is None:
-                continue
-
-            # Find matching visit_details
-            matches = []
-            for vd in visit_detail_dict:
-                # Must be in the same visit_occurrence
-                if vd.get('visit_occurrence_id') != thing.get('visit_occurrence_id'):
-                    continue
-
-                # Get visit_detail dates
-                vd_start_datetime = strip_tz(vd.get(visit_detail_date_fields['start_datetime']))
-                vd_start_date = vd.get(visit_detail_date_fields['start_date'])
-                vd_end_datetime = strip_tz(vd.get(visit_detail_date_fields['end_datetime']))
-                vd_end_date = vd.get(visit_detail_date_fields['end_date'])
-
-                # Check containment (both start and end must be within visit_detail window)
-                in_window = False
-                if isinstance(start_date_value, datetime.datetime) and isinstance(end_date_value, datetime.datetime):
-                    if vd_start_datetime and vd_end_datetime:
-                        in_window = (vd_start_datetime <= start_date_value <= vd_end_datetime and
-                                    vd_start_datetime <= end_date_value <= vd_end_datetime)
-                elif isinstance(start_date_value, datetime.date) and isinstance(end_date_value, datetime.date):
-                    if vd_start_date and vd_end_date:
-                        in_window = (vd_start_date <= start_date_value <= vd_end_date and
-                                   vd_start_date <= end_date_value <= vd_end_date)
-
-                if in_window:
-                    matches.append(vd)
-
-            # Set visit_detail_id based on matches
-            if len(matches) == 1:
-                thing['visit_detail_id'] = matches[0]['visit_detail_id']
-                matched_count += 1
-            elif len(matches) > 1:
-                # Multiple matches - choose most specific (smallest duration)
-                most_specific = min(matches, key=lambda vd: get_visit_detail_duration(vd))
-                thing['visit_detail_id'] = most_specific['visit_detail_id']
-                matched_count += 1
-                logger.debug(f"{domain} event matched {len(matches)} visit_details, chose most specific (id={most_specific['visit_detail_id']})")
-            else:
-                # No match - leave visit_detail_id as None
-                no_match_count += 1
+    Args:
+        data_dict: Dictionary with config_name → list of records (omop_dict)
+        do_visit_detail: also set visit_detail_id from 'VISITDETAIL_visit_occurrence'
+    """
+    VISIT_CFG_NAME = 'Visit'
+    VISIT_DETAIL_CFG_NAME = 'VISITDETAIL_visit_occurrence'
 
-    logger.info(f"{domain}: {matched_count} events matched to visit_detail, {no_match_count} without visit_detail match")
+    visit_dict = data_dict.get(VISIT_CFG_NAME)
+    visit_windows = None
+    if visit_dict is not None:
+        # The visits' windows are the same for every config: work them out once.
+        # They aren't split by person_id: a document is one patient's, and events are
+        # matched to its visits whether or not each person_id was filled in.
+        warn_incomplete_visits(visit_dict)
+        _normalize_datetimes(visit_dict, VISIT_DATETIME_FIELDS)
+        visit_windows = prepare_visit_windows(visit_dict)
+
+    # visit_details, matched within the visit_occurrence they are nested in
+    visit_detail_windows = None
+    if do_visit_detail and data_dict.get(VISIT_DETAIL_CFG_NAME):
+        _normalize_datetimes(data_dict[VISIT_DETAIL_CFG_NAME], VISIT_DETAIL_DATETIME_FIELDS)
+        visit_detail_windows = prepare_visit_detail_windows(data_dict[VISIT_DETAIL_CFG_NAME])
+
+    for domain_name, cfg_name in get_reconciled_configs():
+        if data_dict.get(cfg_name):
+            if visit_dict is None:
+                print(f"NO \"{VISIT_CFG_NAME}\", no visit reconciliation or inference done.")
+            reconcile_visit_FKs_with_specific_domain(domain_name, data_dict[cfg_name], visit_windows, visit_detail_windows)
 
 
-@typechecked
 def get_visit_detail_duration(visit_detail_dict: dict) -> float:
     """
     Calculate duration of a visit_detail in days.
@@ -896,14 +1107,19 @@ def get_visit_detail_duration(visit_detail_dict: dict) -> float:
     """
     start_datetime = visit_detail_dict.get('visit_detail_start_datetime')
     end_datetime = visit_detail_dict.get('visit_detail_end_datetime')
-    start_date = visit_detail_dict.get('visit_detail_start_date')
-    end_date = visit_detail_dict.get('visit_detail_end_date')
+    # Prefer datetime for precision; the dates are only read without both
+    if start_datetime and end_datetime:
+        # Strip timezone to allow subtraction
+        return (strip_tz(end_datetime) - strip_tz(start_datetime)).total_seconds() / 86400  # Convert to days
+    return _visit_detail_duration_days(None, None,
+                                       visit_detail_dict.get('visit_detail_start_date'),
+                                       visit_detail_dict.get('visit_detail_end_date'))
+
 
+def _visit_detail_duration_days(start_datetime, end_datetime, start_date, end_date) -> float:
+    """ get_visit_detail_duration() from bounds already read, the datetimes tz-naive. """
     # Prefer datetime for precision
     if start_datetime and end_datetime:
-        # Strip timezone to allow subtraction
-        start_datetime = strip_tz(start_datetime)
-        end_datetime = strip_tz(end_datetime)
         delta = end_datetime - start_datetime
         return delta.total_seconds() / 86400  # Convert to days
     elif start_date and end_date: